@@ -1,7 +1,9 @@
+import time
+
 from src.library.decorator import allow
 from api.model.files import Files
 from src.library.model import SQLServer
-from src.utils.make_sql import QueryBuild
+from src.library.upload import StreamUpload
 from src.library.controller import BaseCtrl
 from src.library.error import ForbiddenError
 
@@ -13,8 +15,30 @@ class FilesCtrl(BaseCtrl):
 
     @allow('POST')
     async def upload(self, request):
-        # print(await request.form())
-        return 'ok'
+        """
+        流式上传文件(表单字段 file), 按内容哈希存放并记录
+        """
+        ctx = self.make_context(request)
+        upload = StreamUpload(request.headers)
+        # 记录提交后才存放文件, 回滚时删除临时文件, 不会留下没有记录的文件;
+        # 在接收前登记, 接收中被取消时也由回滚清理
+        ctx.uow.on_commit(upload.store)
+        ctx.uow.on_rollback(upload.discard)
+        stored = await upload.receive(request.stream())
+
+        ctx.query.base.way = 'insert'
+        now = int(time.time())
+        params = {'values': {
+            'oname': stored['filename'],
+            'mdname': stored['md5'],
+            'mime': stored['mime'],
+            'ctime': now,
+            'utime': now,
+            'status': 1,
+        }}
+        rows = await self.execute_params(ctx, params)
+        data = {'file': rows[0] if rows else None, 'size': stored['size'], 'duplicate': stored['duplicate']}
+        return {'status': 'success', 'msg': None, 'data': data}
 
     # @allow('POST')
     # async def add(self, request):
@@ -0,0 +1,37 @@
+from src.library.cache import query_cache
+from src.library.decorator import allow
+from src.library.error import DBError
+from src.library.loader import key_loader
+from src.library.model import SQLServer
+from src.library.pipeline import pipeline
+from src.library.writer import write_coalescer
+from src.utils.make_sql import QueryBuild
+
+
+class StatusCtrl:
+
+    @allow('GET')
+    async def ready(self, request):
+        try:
+            await SQLServer().execute_async('select 1')
+        except Exception as e:
+            raise DBError(f'数据库不可用: {e}', status_code=503)
+        return {'status': 'success', 'msg': 'ready', 'data': None}
+
+    @allow('GET')
+    async def pool(self, request):
+        return {'status': 'success', 'msg': None, 'data': SQLServer.pool_stats()}
+
+    @allow('GET')
+    async def middleware(self, request):
+        return {'status': 'success', 'msg': None, 'data': pipeline.stats()}
+
+    @allow('GET')
+    async def cache(self, request):
+        data = {'result': query_cache.stats(), 'sql': QueryBuild.cache_stats(), 'coalesce': SQLServer.coalesce_stats()}
+        return {'status': 'success', 'msg': None, 'data': data}
+
+    @allow('GET')
+    async def batch(self, request):
+        data = {'key': key_loader.stats(), 'write': write_coalescer.stats()}
+        return {'status': 'success', 'msg': None, 'data': data}
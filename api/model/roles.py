@@ -4,6 +4,7 @@ from src.library.model import ModelBase
 
 class Roles(ModelBase):
     __tablename__ = 'roles'
+    __cache_ttl__ = 60
 
     id = Column(INTEGER, primary_key=True, nullable=False)
     role = Column(VARCHAR)
@@ -4,6 +4,7 @@ from src.library.model import ModelBase
 
 class UserRole(ModelBase):
     __tablename__ = 'user_role'
+    __cache_ttl__ = 60
 
     id = Column(INTEGER, primary_key=True, nullable=False)
     rid = Column(INTEGER)
@@ -4,6 +4,7 @@ from src.library.model import ModelBase
 
 class Users(ModelBase):
     __tablename__ = 'users'
+    __exclude_fields__ = ('password',)
 
     id = Column(INTEGER, primary_key=True, nullable=False)
     username = Column(VARCHAR)
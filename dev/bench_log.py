@@ -0,0 +1,58 @@
+"""
+LogTool 单次调用耗时基准
+用法: 在项目根目录执行 python -m dev.bench_log
+"""
+import inspect
+import os
+import sys
+import timeit
+from pathlib import Path
+
+from src.utils.tools import LogTool
+
+ROOT = Path(__file__).resolve().parent.parent
+NUMBER = 20000
+
+
+class LegacyLogTool(LogTool):
+    """
+    优化前的实现: inspect.stack() 取调用方 + 捕获最后一条日志
+    """
+
+    def prefix_info(self, depth=3):
+        frame = inspect.stack()[3]
+        file_path = os.path.splitext(os.path.relpath(frame.filename, self.project_root))[0]
+        prefix = f"{file_path}{'.' + frame.function if frame.function != '<module>' else ''}:{frame.lineno} "
+        return prefix
+
+    def msg_struct(self, level: str, msg: str, *args):
+        prefix = self.prefix_info()
+        msg = msg.replace('{', '【').replace('}', '】')
+        log_method = getattr(self.logger, level.lower())
+        log_method(msg, prefix=prefix)
+        return self.last_info
+
+
+def bench(tool, level):
+    rows = [{'id': i, 'name': f'row{i}'} for i in range(20)]
+    call = getattr(tool, level)
+    seconds = timeit.timeit(lambda: call(f'查询结果: {rows}'), number=NUMBER)
+    return seconds / NUMBER * 1e6
+
+
+def main():
+    legacy = LegacyLogTool(log_level="INFO", log_file=os.devnull, project_root=ROOT, capture=True)
+    results = [('legacy info', bench(legacy, 'info')), ('legacy debug(disabled)', bench(legacy, 'debug'))]
+
+    fast = LogTool(log_level="INFO", log_file=os.devnull, project_root=ROOT)
+    results += [('fast info', bench(fast, 'info')), ('fast debug(disabled)', bench(fast, 'debug'))]
+
+    lazy = timeit.timeit(lambda: fast.debug('查询结果: %s', results), number=NUMBER) / NUMBER * 1e6
+    results.append(('fast debug(disabled, lazy args)', lazy))
+
+    for name, cost in results:
+        sys.stdout.write(f'{name:<34}{cost:>10.2f} us/call\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,11 @@
 from fastapi import FastAPI, Request
 import atexit
 import settings
+from src.library.batch import BatchHandler
 from src.library.handler import RequestHandler
+from src.library.pipeline import pipeline
+from src.library.router import router
+from src.library.schema import registry
 import warnings
 
 warnings.filterwarnings("ignore")
@@ -10,6 +14,18 @@ atexit.register(lambda: settings.log.info(f'SERVER PROCESS FINISHED'))
 
 app = FastAPI()
 
+# 启动时编译路由表、中间件链及模型schema(路由表导入控制器时已加载模型)
+router.build()
+pipeline.build()
+registry.build()
+
+
+# 预检请求由 CorsMiddleware 处理
+@app.api_route("/{module}/batch", methods=["POST", "OPTIONS"])
+async def batch(request: Request):
+    response = await BatchHandler(request).handler()
+    return response
+
 
 @app.api_route("/{module}/{resource}/{action}", methods=settings.CORS_ALLOW_METHODS)
 async def entrance(request: Request):
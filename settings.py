@@ -18,6 +18,18 @@ class SQLConfig:
     USER = 'dgove'
     PASSWORD = '123'
     DB = 'experial'
+    # 连接池常驻连接数
+    POOL_SIZE = 5
+    # 连接池允许溢出的连接数
+    MAX_OVERFLOW = 10
+    # 获取连接的超时时间(秒)
+    POOL_TIMEOUT = 30
+    # 连接回收时间(秒), 需小于MySQL wait_timeout
+    POOL_RECYCLE = 3600
+    # 取出连接前探活
+    POOL_PRE_PING = True
+    # 执行sql的线程池大小, 超过连接池容量(POOL_SIZE + MAX_OVERFLOW)时按容量截断
+    EXECUTOR_WORKERS = 15
 
 
 # 解除限制
@@ -60,6 +72,68 @@ MIDDLEWARES = [
     'src.library.middleware.BaseMiddleware',
 ]
 
+# 中间件单个钩子耗时告警阈值(秒)
+MIDDLEWARE_SLOW_THRESHOLD = 0.05
+
+# 查询结果缓存内存上限(字节), 模型通过 __cache_ttl__ 开启
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# sql结果日志: count 仅记录条数, preview 条数 + 截断预览, full 完整结果
+SQL_LOG_RESULT = 'count'
+# 预览(结果/参数)最大字节数
+SQL_LOG_PREVIEW_BYTES = 1024
+# sql日志采样率
+SQL_LOG_SAMPLE_RATE = 1.0
+# 按路由设置采样率, 如 {'/api/files/all': 0.1}
+SQL_LOG_ROUTE_SAMPLE_RATES = {}
+# 慢查询阈值(秒), 超过时总是记录完整语句及参数
+SQL_SLOW_THRESHOLD = 0.5
+
+# 流式查询每次从游标读取的行数
+STREAM_CHUNK_ROWS = 1000
+
+# 相同sql及参数的查询执行中时, 后来的调用等待其结果而不再重复执行(写操作不合并)
+SQL_COALESCE_ENABLED = True
+
+# 主键查询微批: 并发的 key?id=N 在时间窗口内合并为一条 IN 查询
+KEY_BATCH_ENABLED = False
+# 合并窗口(秒)
+KEY_BATCH_WINDOW = 0.002
+# 单批最多合并的主键数, 达到后立即发出
+KEY_BATCH_MAX_SIZE = 100
+
+# 多行插入每条sql包含的行数
+BULK_INSERT_CHUNK_SIZE = 500
+# 单次多行插入最多行数
+BULK_INSERT_MAX_ROWS = 10000
+
+# 组提交: 并发的单行插入在时间窗口内合并到一个事务中提交
+WRITE_COALESCE_ENABLED = False
+# 合并窗口(秒)
+WRITE_COALESCE_WINDOW = 0.005
+# 单批最多合并的插入数, 达到后立即发出
+WRITE_COALESCE_MAX_SIZE = 100
+
+# 导入(import): 每条多行插入的行数, 每块一个事务
+IMPORT_CHUNK_ROWS = 1000
+# 导入: 汇总中最多返回的错误明细数
+IMPORT_MAX_ERRORS = 100
+# 导入: 每次读取上传内容的字节数
+IMPORT_READ_BYTES = 64 * 1024
+
+# 上传文件存放目录, 按内容哈希存放
+UPLOAD_DIR = os.path.join(BASE_DIR, 'uploads')
+# 单个上传文件最大字节数
+UPLOAD_MAX_BYTES = 1024 * 1024 * 1024
+# 上传写盘的缓冲块大小(字节)
+UPLOAD_WRITE_BYTES = 1024 * 1024
+
+# 批量请求(/{module}/batch)单次最多包含的子请求数
+BATCH_MAX_REQUESTS = 20
+
+# 响应JSON编码器: auto 优先 orjson(未安装时回退标准库), orjson, json
+JSON_ENCODER = 'auto'
+
 LOG_PATH = os.path.join(BASE_DIR, 'logs')
 FileTool.check_path(LOG_PATH)
 LOG_FILE = f'{os.path.join(LOG_PATH, TimeTool.get_format_day())}.log'
@@ -0,0 +1,114 @@
+import asyncio
+from types import SimpleNamespace
+
+from fastapi import Response
+
+from src import conf
+from src.library.context import current_route
+from src.library.error import ParamError
+from src.library.handler import RequestHandler
+from src.library.model import UnitOfWork
+from src.library.router import router
+from src.utils.tools import DataHandler, JsonTool
+
+
+class SubRequest:
+    """
+    批量请求中的子请求: 提供控制器用到的 Request 接口, 参数及请求体已解析
+    """
+
+    def __init__(self, parent, module, item: dict):
+        if not isinstance(item, dict):
+            raise ParamError('子请求须为对象')
+        self.module = module
+        self.resource = str(item.get('resource', ''))
+        self.action = str(item.get('action', ''))
+        self.method = str(item.get('method', 'GET')).upper()
+        params = item.get('params') or {}
+        data = item.get('data') or {}
+        if not isinstance(params, dict) or not isinstance(data, dict):
+            raise ParamError('子请求的 params/data 须为对象')
+        self.params = DataHandler.filter_data(params, DataHandler.FORBIDDEN)
+        self.data = {key: value for key, value in data.items() if key not in DataHandler.FORBIDDEN}
+        # Context.load_data 优先读取 state.data
+        self.state = SimpleNamespace(uow=None, data=self.data)
+        self.headers = parent.headers
+        self.path_params = {'module': module, 'resource': self.resource, 'action': self.action}
+        self.scope = {**parent.scope, 'method': self.method, 'path': f'/{module}/{self.resource}/{self.action}'}
+
+    @property
+    def readonly(self) -> bool:
+        return self.method == 'GET'
+
+
+class BatchHandler(RequestHandler):
+    """
+    批量请求: 一次HTTP请求执行多个子请求, 中间件只对外层请求执行一次
+    连续的读请求并发执行, 写请求按顺序单独执行; 每个子请求使用独立的工作单元, 返回按序排列的结果及状态码
+    """
+
+    async def _router_distribute(self):
+        module = self.request.path_params.get('module', "")
+        body = await self.request.body()
+        try:
+            payload = JsonTool.loads(body) if body else None
+        except ValueError:
+            raise ParamError('请求体不是合法的JSON')
+        items = payload.get('requests') if isinstance(payload, dict) else payload
+        if not isinstance(items, list) or not items:
+            raise ParamError('requests 须为非空列表')
+        if len(items) > conf.BATCH_MAX_REQUESTS:
+            raise ParamError(f'单次批量请求最多{conf.BATCH_MAX_REQUESTS}个')
+
+        results = [None] * len(items)
+        subs = []
+        for index, item in enumerate(items):
+            try:
+                subs.append((index, SubRequest(self.request, module, item)))
+            except ParamError as e:
+                results[index] = self.error(e)
+
+        start = 0
+        while start < len(subs):
+            if not subs[start][1].readonly:
+                index, sub = subs[start]
+                results[index] = await self.run(sub)
+                start += 1
+                continue
+            end = start
+            while end < len(subs) and subs[end][1].readonly:
+                end += 1
+            group = subs[start:end]
+            done = await asyncio.gather(*(self.run(sub) for _, sub in group))
+            for (index, _), res in zip(group, done):
+                results[index] = res
+            start = end
+        return results
+
+    @staticmethod
+    def error(exc) -> dict:
+        return {'status': getattr(exc, 'status_code', 500), 'body': {'status': 'error', 'msg': str(exc)}}
+
+    @staticmethod
+    async def run(sub: SubRequest) -> dict:
+        """
+        执行子请求
+        """
+        current_route.set(sub.scope['path'])
+        uow = UnitOfWork()
+        sub.state.uow = uow
+        try:
+            try:
+                route = router.resolve(sub.module, sub.resource, sub.action, sub.method)
+                res = await route.handler(sub)
+                if isinstance(res, Response):
+                    raise ParamError('批量请求不支持流式等自定义响应')
+                await uow.complete()
+            finally:
+                await uow.abort()
+        except Exception as e:
+            conf.log.warning(f'批量子请求失败: {sub.method} {sub.scope["path"]} {e}')
+            return BatchHandler.error(e)
+        if isinstance(res, dict):
+            res['action'] = sub.action
+        return {'status': 200, 'body': res}
@@ -0,0 +1,143 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from src import conf
+
+
+class QueryCache:
+    """
+    查询结果缓存: 以规范化sql + 绑定参数为键, 按TTL过期, 超出内存上限时LRU淘汰
+    写操作按表失效所有涉及该表(含join)的缓存, 并递增表的版本号;
+    执行前后版本号不一致的查询结果不写入缓存, 避免与并发写交错时缓存旧数据
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        # key -> (过期时间, 估算大小, 涉及的表, 结果)
+        self.entries = OrderedDict()
+        # 表 -> {key}
+        self.tables = {}
+        # 表 -> 版本号, 每次失效加一
+        self.versions = {}
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(sql, binds, shape='rows'):
+        """
+        缓存键(含结果形式), 绑定参数不可哈希时返回 None(不缓存)
+        """
+        key = (' '.join(sql.split()), tuple(sorted((binds or {}).items())), shape)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    @staticmethod
+    def estimate(rows) -> int:
+        """
+        估算结果占用的内存
+        """
+        size = sys.getsizeof(rows)
+        if isinstance(rows, dict):
+            # 列式结果
+            size += sys.getsizeof(rows['columns'])
+            rows = rows['rows']
+        for row in rows:
+            size += sys.getsizeof(row)
+            for value in (row.values() if isinstance(row, dict) else row):
+                size += sys.getsizeof(value)
+        return size
+
+    def limit(self):
+        return self.max_bytes if self.max_bytes is not None else conf.QUERY_CACHE_MAX_BYTES
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self.remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[3]
+
+    def version(self, tables) -> tuple:
+        """
+        执行查询前取涉及的表的版本号
+        """
+        with self.lock:
+            return tuple(self.versions.get(table, 0) for table in tables)
+
+    def set(self, key, rows, tables, ttl, version=None):
+        size = self.estimate(rows)
+        limit = self.limit()
+        if size > limit:
+            return
+        with self.lock:
+            if version is not None and version != tuple(self.versions.get(table, 0) for table in tables):
+                # 查询执行期间表已被写入
+                return
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (time.monotonic() + ttl, size, tables, rows)
+            self.size += size
+            for table in tables:
+                self.tables.setdefault(table, set()).add(key)
+            while self.size > limit:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        """
+        移除缓存项(调用方持有锁)
+        """
+        _, size, tables, _ = self.entries.pop(key)
+        self.size -= size
+        for table in tables:
+            keys = self.tables.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tables[table]
+
+    def invalidate(self, table):
+        """
+        失效涉及该表的所有缓存
+        """
+        with self.lock:
+            self.versions[table] = self.versions.get(table, 0) + 1
+            for key in list(self.tables.get(table, ())):
+                self.remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tables.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'max_bytes': self.limit(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+query_cache = QueryCache()
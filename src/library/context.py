@@ -0,0 +1,54 @@
+from contextvars import ContextVar
+
+from src.library.error import ParamError
+from src.utils.tools import DataHandler, JsonTool
+
+# 当前请求的路由(路径), 供sql日志按路由采样
+current_route = ContextVar('current_route', default=None)
+
+
+class Context:
+    """
+    请求上下文: 承载单次请求的 Query、request 及解析后的参数
+    控制器实例不再保存请求状态, 可被并发请求共享
+    """
+    __slots__ = ('request', 'query', 'params', 'uow', 'data')
+
+    def __init__(self, request, query, uow=None):
+        self.request = request
+        self.query = query
+        self.params = None
+        # 请求级工作单元, 由 RequestHandler 创建并提交
+        self.uow = uow
+        # 请求体, 由 load_data 按需解析
+        self.data = None
+
+    async def load_data(self) -> dict:
+        """
+        按 Content-Type 解析请求体, 同一请求只解析一次:
+        application/json 整体解码一次; 表单逐字段按需解码; 其他类型视为无参数
+        """
+        if self.data is not None:
+            return self.data
+        request = self.request
+        data = getattr(request.state, 'data', None)
+        if data is None:
+            content_type = request.headers.get('content-type', '')
+            if content_type.startswith('application/json'):
+                body = await request.body()
+                try:
+                    data = JsonTool.loads(body) if body else {}
+                except ValueError:
+                    raise ParamError('请求体不是合法的JSON')
+                if not isinstance(data, dict):
+                    raise ParamError('请求体须为JSON对象')
+                data = {key: value for key, value in data.items() if key not in DataHandler.FORBIDDEN}
+            elif content_type.startswith(('multipart/form-data', 'application/x-www-form-urlencoded')):
+                form = await request.form()
+                data = DataHandler.filter_data(dict(form), DataHandler.FORBIDDEN)
+            else:
+                data = {}
+            request.state.data = data
+            request.data = data
+        self.data = data
+        return data
@@ -1,84 +1,345 @@
+import base64
+import json
 import time
 
+from fastapi.responses import StreamingResponse
+
+from src import conf
+from src.library.context import Context
 from src.library.decorator import allow
 from src.library.error import ParamError
+from src.library.importer import RowImporter
+from src.library.loader import key_loader
 from src.utils.make_sql import Query
 from src.library.model import SQLServer
+from src.library.schema import registry
+from src.library.writer import write_coalescer
 from src.utils.make_sql import QueryBuild
 from src.utils.tools import DataHandler
 
 
 class BaseCtrl:
+    # 流式返回支持的格式
+    STREAM_TYPES = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+    # 查询结果形式: rows 字典列表; columns 列名 + 值数组, 宽表时更省CPU和流量
+    SHAPES = ('rows', 'columns')
+
     def __init__(self):
         self.model = None
         self.query = Query
-        self.params = None
+
+    # 类型名 -> (转换函数, 描述)
+    FORMS = {
+        "int": (int, "整数"),
+        "float": (float, "浮点数"),
+        "str": (str, "字符串"),
+        "list": (list, "列表"),
+        "tuple": (tuple, "元组"),
+        "dict": (dict, "字典"),
+    }
+
+    @property
+    def schema(self):
+        """
+        模型的预编译 schema
+        """
+        return registry.get(self.model)
 
     @staticmethod
     def check_type(form, val):
-        forms = {"int": "整数", "float": "浮点数", "str": "字符串", "list": "列表", "tuple": "元组", "dict": "字典"}
-        try:
-            temp = eval(f"{form}({val})")
-            return temp
-        except Exception:
-            raise ParamError(f"参数为{forms.get(form)}")
+        func, label = BaseCtrl.FORMS[form]
+        if isinstance(val, func) and not isinstance(val, bool):
+            return val
+        if func in (int, float, str) and isinstance(val, (int, float, str)) and not isinstance(val, bool):
+            try:
+                return func(val)
+            except ValueError:
+                pass
+        raise ParamError(f"参数为{label}")
+
+    def make_context(self, request) -> Context:
+        """
+        构造请求上下文
+        """
+        return Context(request, self.query(), getattr(request.state, 'uow', None))
 
-    def wrap_params(self):
-        self.params.base.table = self.model.get_table_name()
-        self.params = self.params.build()
-        return self.params
+    def wrap_params(self, ctx: Context):
+        ctx.query.base.table = self.model.get_table_name()
+        ctx.params = ctx.query.build()
+        return ctx.params
 
-    def execute_params(self, params: dict):
-        params.update(self.wrap_params())
-        sql = QueryBuild(params).build().sql
-        res = SQLServer().execute(sql)
+    def result_shape(self, params: dict) -> str:
+        shape = params.get('shape', 'rows')
+        if shape not in self.SHAPES:
+            raise ParamError(f"shape 仅支持 {'/'.join(self.SHAPES)}")
+        return shape
+
+    async def execute_params(self, ctx: Context, params: dict):
+        shape = self.result_shape(params)
+        params.update(self.wrap_params(ctx))
+        params = self.schema.validate(ctx.query.base.way, params)
+        query = QueryBuild(params).build()
+        res = await SQLServer(ctx.uow).execute_async(query.sql, query.binds, shape)
         return res
 
-    def before_key(self, request):
-        self.params = self.query()
-        self.params.base.way = 'select'
-        self.params.where = request.params
+    def stream_params(self, ctx: Context, params: dict, style: str):
+        """
+        以流式响应返回查询结果
+        """
+        if style not in self.STREAM_TYPES:
+            raise ParamError(f"stream 仅支持 {'/'.join(self.STREAM_TYPES)}")
+        shape = self.result_shape(params)
+        params.update(self.wrap_params(ctx))
+        params = self.schema.validate(ctx.query.base.way, params)
+        query = QueryBuild(params).build()
+        chunks = SQLServer().stream_async(query.sql, query.binds, style, shape)
+        return StreamingResponse(chunks, media_type=self.STREAM_TYPES[style])
+
+    def before_key(self, ctx: Context):
+        ctx.query.base.way = 'select'
+        where = dict(ctx.request.params)
+        ctx.query.keys = self.schema.projection(where.pop("fields", None))
+        ctx.query.where = where
         return {}
 
+    def batchable(self, ctx: Context) -> bool:
+        """
+        单主键等值查询可合并为微批; 工作单元已写入该表时直接查询, 以读到本请求未提交的数据
+        """
+        if not conf.KEY_BATCH_ENABLED:
+            return False
+        pk = self.schema.primary_key
+        where = ctx.query.where
+        if len(pk) != 1 or list(where) != pk or isinstance(where[pk[0]], (dict, list)) or where[pk[0]] is None:
+            return False
+        return ctx.uow is None or self.schema.table not in ctx.uow.written
+
     @allow("GET")
     async def key(self, request):
-        params = self.before_key(request)
-        return self.execute_params(params)
+        ctx = self.make_context(request)
+        params = self.before_key(ctx)
+        if self.batchable(ctx):
+            pk = self.schema.primary_key[0]
+            value = self.schema.coerce(pk, ctx.query.where[pk])
+            return await key_loader.load(self.schema.table, pk, ctx.query.keys, value)
+        return await self.execute_params(ctx, params)
 
-    def start_all(self, request):
-        self.params = self.query()
-        self.params.base.way = 'select'
+    def start_all(self, ctx: Context):
+        ctx.query.base.way = 'select'
 
-        params = request.params
-        self.params.offset = self.check_type("int", params.get("offset", 0))
-        self.params.limit = self.check_type("int", params.get("limit", 10))
+        params = ctx.request.params
+        ctx.query.offset = self.check_type("int", params.get("offset", 0))
+        ctx.query.limit = self.check_type("int", params.get("limit", 10))
+        ctx.query.keys = self.schema.projection(params.get("fields", None), params)
+        if 'cursor' in params:
+            self.start_seek(ctx, params)
         return params
 
+    @staticmethod
+    def encode_cursor(keys, values) -> str:
+        return base64.urlsafe_b64encode(json.dumps([keys, values], default=str).encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor, keys) -> list:
+        try:
+            data = json.loads(base64.urlsafe_b64decode(f'{cursor}{"=" * (-len(cursor) % 4)}'.encode()))
+        except Exception:
+            raise ParamError("无效的游标")
+        if not isinstance(data, list) or len(data) != 2 or data[0] != keys or len(data[1]) != len(keys):
+            raise ParamError("游标与排序字段不匹配")
+        return data[1]
+
+    def start_seek(self, ctx: Context, params: dict):
+        """
+        游标(keyset)分页: 按 sort 字段(默认主键)及主键排序, 从上一页末行之后读取, 不使用 OFFSET
+        排序字段不能为 NULL: (NULL, id) > (v, id) 的比较结果为 NULL, 会漏掉记录
+        """
+        pk = self.schema.primary_key[0]
+        sort = params.get("sort", pk)
+        if sort not in self.schema.columns or sort in self.schema.excluded:
+            raise ParamError(f"不支持的排序字段: {sort}")
+        if sort in self.schema.nullable:
+            raise ParamError(f"游标分页的排序字段不能为可空字段: {sort}")
+        if not ctx.query.limit:
+            raise ParamError("游标分页需要指定 limit")
+        keys = [sort, pk] if sort != pk else [pk]
+        order = 'desc' if str(params.get("direction", "asc")).lower() == 'desc' else 'asc'
+        ctx.query.offset = 0
+        ctx.query.order = [(key, order) for key in keys]
+        # 下一页游标取自末行, 排序字段须在返回字段中
+        ctx.query.keys += [key for key in keys if key not in ctx.query.keys]
+        cursor = params.get("cursor", None)
+        if cursor:
+            values = self.decode_cursor(str(cursor), keys)
+            ctx.query.seek = {'keys': keys, 'values': values, 'order': order}
+
+    def page_result(self, ctx: Context, rows: list) -> dict:
+        """
+        游标分页结果: 末页 next_cursor 为 None
+        """
+        keys = [key for key, _ in ctx.query.order]
+        data = rows['rows'] if isinstance(rows, dict) else rows
+        next_cursor = None
+        if data and len(data) >= ctx.query.limit:
+            last = dict(zip(rows['columns'], data[-1])) if isinstance(rows, dict) else data[-1]
+            next_cursor = self.encode_cursor(keys, [last[key] for key in keys])
+        return {'data': rows, 'next_cursor': next_cursor}
+
     @allow('GET')
     async def all(self, request):
-        params = self.start_all(request)
-        return self.execute_params(params)
+        ctx = self.make_context(request)
+        params = self.start_all(ctx)
+        style = params.get('stream', None)
+        if style:
+            return self.stream_params(ctx, params, style)
+        res = await self.execute_params(ctx, params)
+        if 'cursor' in params:
+            return self.page_result(ctx, res)
+        return res
 
-    def start_add(self, request):
-        self.params = self.query()
-        self.params.base.way = 'insert'
-        params: dict = request.data
+    def start_add(self, ctx: Context):
+        ctx.query.base.way = 'insert'
+        params: dict = ctx.data
         if "values" not in params.keys():
             raise ParamError("缺少关键参数")
 
         now = int(time.time())
-        params["values"].update({"ctime": now, "utime": now, "status": 1})
+        stamp = {"ctime": now, "utime": now, "status": 1}
+        values = params["values"]
+        if isinstance(values, list):
+            if len(values) > conf.BULK_INSERT_MAX_ROWS:
+                raise ParamError(f"单次最多插入{conf.BULK_INSERT_MAX_ROWS}条")
+            # 整批共用同一时间戳
+            params["values"] = [{**row, **stamp} if isinstance(row, dict) else row for row in values]
+        else:
+            values.update(stamp)
         return params
 
+    async def bulk_insert(self, ctx: Context, params: dict) -> dict:
+        """
+        多行插入(含 upsert): 按 BULK_INSERT_CHUNK_SIZE 分块生成 INSERT ... VALUES (...),(...), 在请求的工作单元内一次提交
+        数据库不支持 RETURNING 时 upsert 只能得到受影响行数, 返回 {'count': None, 'affected': ...}, 见 bulk_insert_by_sql
+        """
+        params.update(self.wrap_params(ctx))
+        params = self.schema.validate(ctx.query.base.way, params)
+        rows = params['values']
+        size = conf.BULK_INSERT_CHUNK_SIZE
+        server = SQLServer(ctx.uow)
+        way = ctx.query.base.way
+        count, data, affected = 0, [], None
+        for start in range(0, len(rows), size):
+            query = QueryBuild({**params, 'values': rows[start:start + size]}).build()
+            res = await server.connect_async(server.bulk_insert_by_sql, query.sql, query.binds, way, write=True)
+            if 'affected' in res:
+                affected = (affected or 0) + res['affected']
+            else:
+                count += res['count']
+            data = None if data is None or res['data'] is None else data + res['data']
+        if affected is not None:
+            return {'count': None, 'affected': affected, 'data': None}
+        return {'count': count, 'data': data}
+
+    @staticmethod
+    def coalescible(ctx: Context) -> bool:
+        """
+        开启组提交且本请求尚未在工作单元中读写时, 单行插入交给组提交
+        """
+        if not conf.WRITE_COALESCE_ENABLED:
+            return False
+        return ctx.uow is None or (ctx.uow.session is None and not ctx.uow.written)
+
     @allow('POST')
     async def add(self, request):
-        params = self.start_add(request)
-        return self.execute_params(params)
+        ctx = self.make_context(request)
+        await ctx.load_data()
+        params = self.start_add(ctx)
+        if isinstance(params["values"], list):
+            return await self.bulk_insert(ctx, params)
+        if self.coalescible(ctx):
+            params.update(self.wrap_params(ctx))
+            params = self.schema.validate('insert', params)
+            query = QueryBuild(params).build()
+            return await write_coalescer.insert(self.schema.table, query.sql, query.binds)
+        return await self.execute_params(ctx, params)
+
+    def start_upsert(self, ctx: Context):
+        """
+        插入或按冲突字段(默认主键)更新; 与 update 一样不允许修改 cname/ctime/status
+        """
+        ctx.query.base.way = 'upsert'
+        params: dict = ctx.data
+        if "values" not in params.keys():
+            raise ParamError("缺少关键参数")
+        values = params["values"] if isinstance(params["values"], list) else [params["values"]]
+        if not values or len(values) > conf.BULK_INSERT_MAX_ROWS:
+            raise ParamError(f"values 须为1~{conf.BULK_INSERT_MAX_ROWS}条记录")
+        if not all(isinstance(row, dict) for row in values):
+            raise ParamError("values 须为对象或对象列表")
+
+        protected = ["cname", "ctime", "status"]
+        now = int(time.time())
+        rows = [{**DataHandler.filter_data(row, protected), "ctime": now, "utime": now, "status": 1} for row in values]
+        keys = params.get("conflict", None) or self.schema.primary_key
+        if isinstance(keys, str):
+            keys = [keys]
+        ctx.query.upsert = {
+            'keys': keys,
+            'update': [key for key in rows[0] if key not in protected and key not in keys],
+            'dialect': SQLServer.get_engine().dialect.name,
+        }
+        params["values"] = rows
+        return params
+
+    @allow('POST')
+    async def upsert(self, request):
+        ctx = self.make_context(request)
+        await ctx.load_data()
+        params = self.start_upsert(ctx)
+        return await self.bulk_insert(ctx, params)
+
+    # Content-Type -> 导入格式
+    IMPORT_TYPES = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson', 'application/jsonl': 'ndjson'}
+
+    async def import_source(self, request):
+        """
+        导入内容: multipart 表单的 file 字段, 或直接以请求体上传
+        :return: (格式, 异步字节块迭代器)
+        """
+        style = request.params.get("format", None)
+        content_type = request.headers.get('content-type', '').split(';')[0].strip()
+        if content_type != 'multipart/form-data':
+            return style or self.IMPORT_TYPES.get(content_type), request.stream()
+
+        # 表单中的文件由 starlette 落盘暂存, 读取时按块进行
+        form = await request.form()
+        upload = form.get("file", None)
+        if upload is None or isinstance(upload, str):
+            raise ParamError("缺少上传文件 file")
+        if style is None:
+            name = (upload.filename or '').lower()
+            style = 'csv' if name.endswith('.csv') else 'ndjson' if name.endswith(('.ndjson', '.jsonl')) else None
+            style = style or self.IMPORT_TYPES.get(upload.content_type)
+
+        async def chunks():
+            while True:
+                chunk = await upload.read(conf.IMPORT_READ_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+        return style, chunks()
+
+    @allow('POST', name='import')
+    async def import_rows(self, request):
+        """
+        流式导入 CSV/NDJSON, 返回成功/失败行数汇总
+        """
+        style, chunks = await self.import_source(request)
+        summary = await RowImporter(self.schema, style, chunks).run()
+        return {'status': 'success', 'msg': None, 'data': summary}
 
-    def start_update(self, request):
-        self.params = self.query()
-        self.params.base.way = 'update'
-        params: dict = request.data
+    def start_update(self, ctx: Context):
+        ctx.query.base.way = 'update'
+        params: dict = ctx.data
         if not DataHandler.check_keys(params, ["where", "values"]):
             raise ParamError("缺少关键参数")
         now = int(time.time())
@@ -88,13 +349,14 @@ class BaseCtrl:
 
     @allow('PUT')
     async def update(self, request):
-        params = self.start_update(request)
-        return self.execute_params(params)
+        ctx = self.make_context(request)
+        await ctx.load_data()
+        params = self.start_update(ctx)
+        return await self.execute_params(ctx, params)
 
-    def start_delete(self, request):
-        self.params = self.query()
-        self.params.base.way = 'update'
-        params: dict = request.data
+    def start_delete(self, ctx: Context):
+        ctx.query.base.way = 'update'
+        params: dict = ctx.data
         if not DataHandler.check_keys(params, ["where", "values"]):
             raise ParamError("缺少关键参数")
         now = int(time.time())
@@ -103,6 +365,8 @@ class BaseCtrl:
 
     @allow('DELETE')
     async def delete(self, request):
-        params = self.start_delete(request)
-        return self.execute_params(params)
+        ctx = self.make_context(request)
+        await ctx.load_data()
+        params = self.start_delete(ctx)
+        return await self.execute_params(ctx, params)
 
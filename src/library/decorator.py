@@ -1,8 +1,9 @@
 from src.library.error import ForbiddenError
 
 
-def allow(method: str):
+def allow(method: str, name: str = None):
     # method: 请求方法
+    # name: 动作名, 默认为方法名; 用于动作名为 python 关键字(如 import)的情况
     def decorator(func):
         def method_allow(*args, **kwargs):
             if len(args) > 1:
@@ -11,6 +12,9 @@ def allow(method: str):
                     raise ForbiddenError('请求错误')
             return func(*args, **kwargs)
 
+        # 供路由表注册时读取
+        method_allow.method = method
+        method_allow.action = name
         return method_allow
 
     return decorator
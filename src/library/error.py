@@ -1,8 +1,10 @@
 class Error(Exception):
     """Base class for exceptions in this module."""
 
-    def __init__(self, msg, status_code=403):
+    def __init__(self, msg, status_code=403, headers=None):
         self.status_code = status_code
+        # 随错误响应返回的响应头, 如 405 的 Allow
+        self.headers = headers
         super().__init__(msg)
 
 
@@ -1,10 +1,9 @@
-import importlib
-import os
 from fastapi import Response, Request
 
-from src import conf
-from src.library.error import ResourceError
-from src.utils.tools import ContentTool
+from src.library.context import current_route
+from src.library.model import UnitOfWork
+from src.library.pipeline import pipeline
+from src.library.router import router
 
 
 class RequestHandler:
@@ -17,35 +16,19 @@ class RequestHandler:
         elif isinstance(res, Request):
             self.request = res
 
-    @staticmethod
-    def instantiate_middleware(middleware: str):
-        """
-        实例化中间件
-        """
-        parts = middleware.split('.')
-        module_name = '.'.join(parts[:-1])
-        class_name = parts[-1]
-        try:
-            module = importlib.import_module(module_name)
-            return getattr(module, class_name)()
-        except Exception as e:
-            raise ResourceError(f'中间件异常: {e}')
-
     async def _request(self):
         """
         [分派路由前]请求中间件操作
         """
-        for middleware in conf.MIDDLEWARES:
-            ware = self.instantiate_middleware(middleware)
-            if hasattr(ware, 'before_request'):
-                res = await ware.before_request(self.request)
-                self._vote_res(res)
+        for name, hook in pipeline.hooks['before_request']:
+            res = await pipeline.call(name, 'before_request', hook, self.request)
+            if self._vote_res(res) is not None:
+                return res
 
-        for middleware in conf.MIDDLEWARES:
-            ware = self.instantiate_middleware(middleware)
-            if hasattr(ware, 'after_request'):
-                res = await ware.after_request(self.request)
-                self._vote_res(res)
+        for name, hook in pipeline.hooks['after_request']:
+            res = await pipeline.call(name, 'after_request', hook, self.request)
+            if self._vote_res(res) is not None:
+                return res
 
     async def _router_distribute(self):
         """
@@ -57,44 +40,21 @@ class RequestHandler:
         resource = self.request.path_params.get('resource', "")
         action = self.request.path_params.get('action', "")
 
-        try:
-            entries = os.listdir(f'{conf.BASE_DIR}/{module}/controller/')
-        except FileNotFoundError:
-            raise ResourceError('Module does not exist.')
-
-        interfaces = [f[:-3] for f in entries if f.endswith('.py')]
-        interface_name = resource.replace('-', '_')
-        if resource not in interfaces:
-            raise ResourceError('Resource does not exist.', status_code=404)
-
-        ctrl_module = importlib.import_module(f'{module}.controller.{interface_name}')
-        ctrl_name = ContentTool(interface_name).multiword_construct(delimiter='_')
-        ctrl_class = getattr(ctrl_module, f'{ctrl_name}Ctrl')
-        instance = ctrl_class()
-        if hasattr(instance, action) and callable(getattr(instance, action)):
-            if getattr(instance, action).__name__ == 'method_allow':
-                res = await getattr(instance, action)(self.request)
-                if isinstance(res, dict):
-                    res['action'] = action
-                return res
-            else:
-                raise ResourceError('Action does not allow.', status_code=405)
-        else:
-            raise ResourceError('Action does not exist.', status_code=405)
+        route = router.resolve(module, resource, action, self.request.method)
+        res = await route.handler(self.request)
+        if isinstance(res, dict):
+            res['action'] = action
+        return res
 
     async def _response(self, response) -> Response:
         """
         [反馈-构造完响应]响应中间件操作
         """
-        for middleware in conf.MIDDLEWARES:
-            ware = self.instantiate_middleware(middleware)
-            if hasattr(ware, 'before_resposne'):
-                response = await ware.before_resposne(self.request, response)
+        for name, hook in pipeline.hooks['before_resposne']:
+            response = await pipeline.call(name, 'before_resposne', hook, self.request, response)
 
-        for middleware in conf.MIDDLEWARES:
-            ware = self.instantiate_middleware(middleware)
-            if hasattr(ware, 'after_response'):
-                response = await ware.after_response(self.request, response)
+        for name, hook in pipeline.hooks['after_response']:
+            response = await pipeline.call(name, 'after_response', hook, self.request, response)
 
         return response
 
@@ -102,23 +62,31 @@ class RequestHandler:
         """
         异常中间件操作
         """
-        for middleware in conf.MIDDLEWARES:
-            ware = self.instantiate_middleware(middleware)
-            if hasattr(ware, 'deal_exception'):
-                res = await ware.deal_exception(error)
-                if res:
-                    return res
+        for name, hook in pipeline.hooks['deal_exception']:
+            res = await pipeline.call(name, 'deal_exception', hook, error)
+            if res:
+                return res
 
     async def handler(self):
         """
         处理中心
         """
+        if not pipeline.compiled:
+            pipeline.build()
+        current_route.set(self.request.scope.get('path'))
+        uow = UnitOfWork()
+        self.request.state.uow = uow
         try:
-            res = await self._request()
-            if isinstance(res, Response):
-                res = await self._response(res)
-                return res
-            res = await self._router_distribute()
+            try:
+                res = await self._request()
+                if isinstance(res, Response):
+                    res = await self._response(res)
+                    return res
+                res = await self._router_distribute()
+                await uow.complete()
+            finally:
+                # 未提交时(含异常及请求被取消)回滚并释放连接
+                await uow.abort()
         except Exception as e:
             res = await self._exception(e)
 
@@ -0,0 +1,209 @@
+import codecs
+import csv
+import json
+import time
+
+from sqlalchemy import text
+
+from src import conf
+from src.library.cache import query_cache
+from src.library.error import Error, ParamError
+from src.library.model import SQLServer
+from src.library.schema import ModelSchema, to_str
+from src.utils.make_sql import QueryBuild
+
+
+class RowImporter:
+    """
+    批量导入: 流式读取 CSV/NDJSON, 逐行按模型字段校验, 多行插入
+    读取及解析在事件循环中进行, 只把凑满 IMPORT_CHUNK_ROWS 行的块交给线程池, 每块一个短事务;
+    等待上传内容期间不占用连接、事务及线程, 内存占用与文件大小无关
+    """
+    FORMATS = ('csv', 'ndjson')
+
+    def __init__(self, schema: ModelSchema, style, chunks):
+        if style not in self.FORMATS:
+            raise ParamError(f"format 仅支持 {'/'.join(self.FORMATS)}")
+        self.schema = schema
+        self.style = style
+        # 上传内容的异步迭代器(bytes)
+        self.chunks = chunks
+        self.now = int(time.time())
+        self.processed = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = []
+
+    async def lines(self):
+        """
+        增量解码为文本行(保留换行符)
+        """
+        decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        rest = ''
+        async for chunk in self.chunks:
+            if not chunk:
+                continue
+            rest += decoder.decode(chunk)
+            lines = rest.splitlines(keepends=True)
+            rest = lines.pop() if lines and not lines[-1].endswith(('\n', '\r')) else ''
+            for line in lines:
+                yield line
+        rest += decoder.decode(b'', final=True)
+        if rest:
+            yield rest
+
+    async def csv_records(self):
+        """
+        按引号成对判断记录是否结束(引号内可含换行, 转义的 "" 不影响奇偶), 完整的记录再交给 csv 解析
+        :return: (行号, 记录 | 错误信息)
+        """
+        header = None
+        record = ''
+        number = 0
+        async for line in self.lines():
+            number += 1
+            record += line
+            if record.count('"') % 2:
+                continue
+            text, record = record, ''
+            try:
+                values = next(csv.reader([text]), [])
+            except csv.Error as e:
+                yield number, f'CSV格式错误: {e}'
+                continue
+            if not values:
+                continue
+            if header is None:
+                header = values
+            elif len(values) > len(header):
+                yield number, '字段数多于表头'
+            else:
+                yield number, dict(zip(header, values + [None] * (len(header) - len(values))))
+        if record:
+            yield number, 'CSV格式错误: 引号未闭合'
+
+    async def records(self):
+        """
+        :return: (行号, 记录 | 错误信息)
+        """
+        if self.style == 'csv':
+            async for item in self.csv_records():
+                yield item
+            return
+        number = 0
+        async for line in self.lines():
+            number += 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield number, '不是合法的JSON'
+                continue
+            yield number, row if isinstance(row, dict) else '须为JSON对象'
+
+    def prepare(self, row: dict) -> dict:
+        """
+        校验并转换一行, 加上创建时间等字段
+        """
+        if self.style == 'csv':
+            # csv 中非字符串字段的空值视为 NULL
+            row = {key: None if value == '' and self.schema.columns.get(key, (to_str,))[0] is not to_str else value
+                   for key, value in row.items()}
+        values = self.schema.coerce_values(row)
+        values.update({"ctime": self.now, "utime": self.now, "status": 1})
+        return values
+
+    def reject(self, line, msg):
+        self.rejected += 1
+        if len(self.errors) < conf.IMPORT_MAX_ERRORS:
+            self.errors.append({'line': line, 'msg': msg})
+
+    def insert(self, session, rows) -> int:
+        """
+        插入一块字段相同的记录; 整块失败时在保存点中逐行重试, 定位失败的行
+        """
+        values = [values for _, values in rows]
+        query = QueryBuild({'base': {'table': self.schema.table, 'way': 'insert'}, 'values': values}).build()
+        savepoint = session.begin_nested()
+        try:
+            session.execute(text(query.sql), query.binds)
+            savepoint.commit()
+            return len(rows)
+        except Exception:
+            savepoint.rollback()
+        count = 0
+        for line, values in rows:
+            query = QueryBuild({'base': {'table': self.schema.table, 'way': 'insert'}, 'values': values}).build()
+            savepoint = session.begin_nested()
+            try:
+                session.execute(text(query.sql), query.binds)
+                savepoint.commit()
+                count += 1
+            except Exception as e:
+                savepoint.rollback()
+                self.reject(line, f'写入失败: {getattr(e, "orig", e)}')
+        return count
+
+    def write(self, rows) -> int:
+        """
+        [线程池]在一个短事务中写入一块并提交
+        """
+        session = SQLServer.get_db()
+        try:
+            count = self.insert(session, rows)
+            session.commit()
+            return count
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+            query_cache.invalidate(self.schema.table)
+
+    async def flush(self, server: SQLServer, rows):
+        self.accepted += await server.connect_async(self.write, rows)
+        conf.log.info(f'导入{self.schema.table}进度: 处理{self.processed}行, 成功{self.accepted}, 失败{self.rejected}')
+
+    async def run(self) -> dict:
+        """
+        执行导入
+        :return: 汇总 {'processed', 'accepted', 'rejected', 'errors', 'aborted'}
+        """
+        start = time.perf_counter()
+        table = self.schema.table
+        server = SQLServer()
+        # 字段组合 -> [(行号, 记录)], 字段相同的行才能合并到一条插入
+        pending = {}
+        aborted = None
+        try:
+            async for line, row in self.records():
+                self.processed += 1
+                if isinstance(row, str):
+                    self.reject(line, row)
+                    continue
+                try:
+                    values = self.prepare(row)
+                except Error as e:
+                    self.reject(line, str(e))
+                    continue
+                rows = pending.setdefault(tuple(values), [])
+                rows.append((line, values))
+                if len(rows) >= conf.IMPORT_CHUNK_ROWS:
+                    await self.flush(server, pending.pop(tuple(values)))
+            for rows in pending.values():
+                await self.flush(server, rows)
+        except Exception as e:
+            # 已提交的块保留
+            conf.log.error(f'导入{table}中止: {e}')
+            aborted = str(e)
+        conf.log.info(f'导入{table}完成: 处理{self.processed}行, 成功{self.accepted}, 失败{self.rejected}, '
+                      f'耗时{time.perf_counter() - start:.2f}s')
+        return {
+            'processed': self.processed,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'aborted': aborted,
+        }
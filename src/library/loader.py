@@ -0,0 +1,62 @@
+from src.library.micro_batch import MicroBatcher
+from src.library.model import SQLServer
+from src.utils.make_sql import QueryBuild
+
+
+class KeyLoader(MicroBatcher):
+    """
+    主键查询微批: 同一表、同一投影的并发主键查询在时间窗口内(或达到数量上限时)合并为一条 IN 查询,
+    结果按主键分发给各个等待的协程
+    """
+    WINDOW_SETTING = 'KEY_BATCH_WINDOW'
+    MAX_SIZE_SETTING = 'KEY_BATCH_MAX_SIZE'
+
+    def __init__(self, window=None, max_size=None):
+        super().__init__(window, max_size)
+        self.loads = 0
+        self.rows = 0
+
+    @staticmethod
+    def size(batch) -> int:
+        # 按不同主键数计
+        return len({value for value, _ in batch})
+
+    async def load(self, table, pk, fields, value) -> list:
+        """
+        查询主键为 value 的记录
+        """
+        self.loads += 1
+        return await self.submit((table, pk, tuple(fields)), value)
+
+    async def run(self, key, batch):
+        table, pk, fields = key
+        keys = list(fields) if pk in fields else [*fields, pk]
+        params = {
+            'base': {'table': table, 'way': 'select'},
+            'keys': keys,
+            'where': {pk: {'in': list(dict.fromkeys(value for value, _ in batch))}},
+        }
+        query = QueryBuild(params).build()
+        rows = await SQLServer().execute_async(query.sql, query.binds)
+        self.rows += len(rows)
+        groups = {}
+        for row in rows:
+            # 拷贝后再去掉补充查询的主键, 不修改可能与缓存共享的记录
+            row = dict(row)
+            value = row[pk] if pk in fields else row.pop(pk)
+            groups.setdefault(value, []).append(row)
+        for value, future in batch:
+            if not future.done():
+                future.set_result([dict(row) for row in groups.get(value, [])])
+
+    def stats(self) -> dict:
+        return {
+            'loads': self.loads,
+            'batches': self.batches,
+            'rows': self.rows,
+            'avg_batch': round(self.loads / self.batches, 2) if self.batches else 0,
+            'pending': self.pending_count(),
+        }
+
+
+key_loader = KeyLoader()
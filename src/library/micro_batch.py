@@ -0,0 +1,91 @@
+import asyncio
+
+from src import conf
+from src.library.error import DBError
+
+
+class MicroBatcher:
+    """
+    微批调度: 同一键的请求在时间窗口内(或达到数量上限时)合并为一个批次, 由子类的 run 执行并设置各等待者的结果
+    保持批次任务的引用直到结束; 批次失败(含取消)或未设置结果时, 所有等待者都收到异常, 不会挂起
+    """
+    # 时间窗口及数量上限的配置项名
+    WINDOW_SETTING = None
+    MAX_SIZE_SETTING = None
+
+    def __init__(self, window=None, max_size=None):
+        self.window = window
+        self.max_size = max_size
+        # 键 -> [(请求项, future)]
+        self.pending = {}
+        self.handles = {}
+        # 执行中的批次任务
+        self.tasks = set()
+        self.batches = 0
+
+    def get_window(self):
+        return self.window if self.window is not None else getattr(conf, self.WINDOW_SETTING)
+
+    def get_max_size(self):
+        return self.max_size if self.max_size is not None else getattr(conf, self.MAX_SIZE_SETTING)
+
+    @staticmethod
+    def size(batch) -> int:
+        """
+        批次大小, 与数量上限比较
+        """
+        return len(batch)
+
+    async def submit(self, key, item):
+        """
+        加入键对应的批次, 等待结果
+        """
+        loop = asyncio.get_running_loop()
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = self.pending[key] = []
+            self.handles[key] = loop.call_later(self.get_window(), self.dispatch, key)
+        future = loop.create_future()
+        batch.append((item, future))
+        if self.size(batch) >= self.get_max_size():
+            self.dispatch(key)
+        return await future
+
+    def dispatch(self, key):
+        """
+        发出当前批次
+        """
+        batch = self.pending.pop(key, None)
+        handle = self.handles.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+        if batch:
+            task = asyncio.ensure_future(self.execute(key, batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def execute(self, key, batch):
+        self.batches += 1
+        try:
+            await self.run(key, batch)
+        except BaseException as e:
+            error = e if isinstance(e, Exception) else DBError('批次执行被取消')
+            self.fail(batch, error)
+            if not isinstance(e, Exception):
+                raise
+        self.fail(batch, DBError('批次未返回结果'))
+
+    @staticmethod
+    def fail(batch, error):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def run(self, key, batch):
+        """
+        执行批次, 为每个 future 设置结果或异常
+        """
+        raise NotImplementedError
+
+    def pending_count(self) -> int:
+        return sum(len(batch) for batch in self.pending.values())
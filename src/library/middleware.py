@@ -1,9 +1,7 @@
-import json
 from fastapi import Request, Response
 from src import conf
-from src.utils.tools import DataHandler
+from src.utils.tools import DataHandler, JsonTool
 import traceback
-from json import dumps
 
 
 class BaseMiddleware:
@@ -16,14 +14,9 @@ class BaseMiddleware:
         return request
 
     async def after_request(self, request: Request):
-        forbidden_param = ['base']
-        params = dict(request.query_params)
-        request.params = DataHandler.filter_data(params, forbidden_param)
+        # 请求体在控制器动作需要时才解析, 见 Context.load_data
+        request.params = DataHandler.filter_data(dict(request.query_params), DataHandler.FORBIDDEN)
         # print(request.params)
-
-        data = await request.form()
-        request.data = DataHandler.filter_data(dict(data), forbidden_param)
-        # print(request.data)
         return request
 
     async def before_resposne(self, request, response: Response):
@@ -43,9 +36,10 @@ class BaseMiddleware:
     async def deal_exception(self, exc):
         conf.log.error('构造响应体时遇到异常')
         conf.log.error(traceback.format_exc())
-        status_code = exc.status_code
-        content = json.dumps({'status': 'error', 'msg': str(exc)})
-        return Response(content=content, status_code=status_code)
+        status_code = getattr(exc, 'status_code', 500)
+        content = JsonTool.dumps({'status': 'error', 'msg': str(exc)})
+        return Response(content=content, status_code=status_code, headers=getattr(exc, 'headers', None),
+                        media_type='application/json')
 
 
 class CorsMiddleware:
@@ -54,7 +48,7 @@ class CorsMiddleware:
             headers = {
                 'Access-Control-Allow-Methods': ','.join(conf.CORS_ALLOW_METHODS),
                 'Access-Control-Allow-Headers': ','.join(conf.CORS_ALLOW_HEADERS),
-                'Access-Control-Max-Age': conf.CORS_MAX_AGE,
+                'Access-Control-Max-Age': str(conf.CORS_MAX_AGE),
             }
             return Response(content='Pre inspection passed', headers=headers)
 
@@ -67,7 +61,7 @@ class CorsMiddleware:
 
         headers = {}
         if isinstance(response, (dict, list)):
-            response = dumps(response, sort_keys=True)
+            response = JsonTool.dumps(response)
             headers['Content-Type'] = 'application/json'
         else:
             headers['Content-Type'] = 'text/plain'
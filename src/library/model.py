@@ -1,19 +1,39 @@
 from sqlalchemy.orm import declarative_base
 from src.utils.make_sql import QueryBuild
+import asyncio
+import contextvars
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union
 
-from sqlalchemy import create_engine, text, delete
+from sqlalchemy import create_engine, text, delete, event
 from sqlalchemy.orm import sessionmaker
 from settings import SQLConfig
+from src.library.cache import query_cache
 from src.library.error import DBError
-from src.conf import log
+from src.library.sql_log import SQLLog
+from src.utils.tools import JsonTool
+from src import conf
+from src.conf import log, SQL_SLOW_THRESHOLD, STREAM_CHUNK_ROWS
 
 Base = declarative_base()
 
+# 表名 -> 模型类
+MODEL_TABLES = {}
+# sql中涉及的表(from/join)
+TABLE_PATTERN = re.compile(r'\b(?:from|join)\s+`(.*?)`', re.IGNORECASE)
+
 
 class ModelBase(Base):
     __abstract__ = True
+    # 查询结果缓存时间(秒), None 不缓存
+    __cache_ttl__ = None
+    # 默认返回的字段, None 为除排除字段外的所有字段
+    __default_fields__ = None
+    # 不允许查询返回的字段
+    __exclude_fields__ = ()
 
     def __init__(self):
         super().__init__()
@@ -36,6 +56,20 @@ class ModelBase(Base):
         # 返回主键字段的名称列表
         return list(primary_key_columns.keys())
 
+    @classmethod
+    def get_model(cls, table):
+        """
+        根据表名获取模型类
+        """
+        model = MODEL_TABLES.get(table)
+        if model is not None:
+            return model
+        for mapper in Base.registry.mappers:
+            if getattr(mapper.class_, '__tablename__', None) == table:
+                MODEL_TABLES[table] = mapper.class_
+                return mapper.class_
+        return None
+
     @classmethod
     def get_columns(cls):
         """
@@ -43,6 +77,13 @@ class ModelBase(Base):
         """
         return cls.__table__.columns.keys()
 
+    @classmethod
+    def get_default_fields(cls):
+        """
+        默认返回的字段(查询及写操作的返回), 不含排除字段
+        """
+        return cls.__default_fields__ or [name for name in cls.get_columns() if name not in cls.__exclude_fields__]
+
     def read_attr_value(self, attr_name):
         """
         根据模属性获取值
@@ -121,120 +162,611 @@ class ParamJoin(BaseParam):
         self.on = on
 
 
+class PoolMonitor:
+    """
+    连接池监控: 统计连接的取出/归还、新建/关闭及取连接等待时间
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engine = None
+        self.connects = 0
+        self.closes = 0
+        self.invalidated = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def count(self, attr):
+        with self.lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def listen(self, engine):
+        """
+        注册连接池事件
+        """
+        self.engine = engine
+        event.listen(engine, 'connect', lambda *args: self.count('connects'))
+        event.listen(engine, 'close', lambda *args: self.count('closes'))
+        event.listen(engine, 'invalidate', lambda *args: self.count('invalidated'))
+        event.listen(engine, 'checkout', lambda *args: self.count('checkouts'))
+        event.listen(engine, 'checkin', lambda *args: self.count('checkins'))
+
+    def record_wait(self, elapsed):
+        """
+        记录取连接等待时间
+        """
+        with self.lock:
+            self.waits += 1
+            self.wait_total += elapsed
+            if elapsed > self.wait_max:
+                self.wait_max = elapsed
+
+    def stats(self) -> dict:
+        pool = self.engine.pool if self.engine is not None else None
+
+        def probe(name):
+            func = getattr(pool, name, None)
+            return func() if callable(func) else None
+
+        overflow = probe('overflow')
+        return {
+            'pool_size': probe('size'),
+            'checked_out': probe('checkedout'),
+            'idle': probe('checkedin'),
+            # QueuePool 未占满常驻连接时 overflow 为负数
+            'overflow': max(overflow, 0) if overflow is not None else None,
+            'max_overflow': SQLConfig.MAX_OVERFLOW,
+            'checkouts': self.checkouts,
+            'checkins': self.checkins,
+            'connects': self.connects,
+            'closes': self.closes,
+            'invalidated': self.invalidated,
+            'wait_avg_ms': round(self.wait_total / self.waits * 1000, 3) if self.waits else 0,
+            'wait_max_ms': round(self.wait_max * 1000, 3),
+        }
+
+
 class SQLServer:
     DATABASE_URL = f'{SQLConfig.ENGINE}://{SQLConfig.USER}:{SQLConfig.PASSWORD}@{SQLConfig.HOST}:{SQLConfig.PORT}/{SQLConfig.DB}'
-    SESSION = sessionmaker(autocommit=False, autoflush=True, bind=create_engine(DATABASE_URL))
+    ENGINE = None
+    SESSION = None
+    EXECUTOR = None
+    # 连接槽: 同时取出的连接数不超过连接池容量, 线程池中的任务不会阻塞在取连接上
+    SLOTS = None
+    SLOTS_LOOP = None
+    MONITOR = PoolMonitor()
+    LOCK = threading.Lock()
+    # 执行中的查询: 键 -> future, 相同查询合并为一次执行
+    INFLIGHT = {}
+    COALESCE = {'executions': 0, 'coalesced': 0}
+
+    @classmethod
+    def get_engine(cls):
+        """
+        首次使用时按 SQLConfig 创建引擎及连接池
+        """
+        if cls.ENGINE is None:
+            with cls.LOCK:
+                if cls.ENGINE is None:
+                    engine = create_engine(
+                        cls.DATABASE_URL,
+                        pool_size=SQLConfig.POOL_SIZE,
+                        max_overflow=SQLConfig.MAX_OVERFLOW,
+                        pool_timeout=SQLConfig.POOL_TIMEOUT,
+                        pool_recycle=SQLConfig.POOL_RECYCLE,
+                        pool_pre_ping=SQLConfig.POOL_PRE_PING,
+                    )
+                    cls.MONITOR.listen(engine)
+                    cls.SESSION = sessionmaker(autocommit=False, autoflush=True, bind=engine)
+                    cls.ENGINE = engine
+        return cls.ENGINE
 
     @staticmethod
     def get_session():
-        session = SQLServer.SESSION()
+        session = SQLServer.get_db()
         try:
             yield session
         finally:
             session.close()
 
-    @staticmethod
-    def get_db():
-        return next(SQLServer.get_session())
+    @classmethod
+    def get_db(cls):
+        """
+        创建会话并立即取出连接, 记录等待时间
+        """
+        if cls.SESSION is None:
+            cls.get_engine()
+        session = cls.SESSION()
+        start = time.perf_counter()
+        session.connection()
+        cls.MONITOR.record_wait(time.perf_counter() - start)
+        return session
+
+    def __init__(self, uow=None):
+        self.uow = uow
+
+    def open_session(self, write=False):
+        """
+        获取会话: 工作单元已开始事务(写入过)时复用其会话; 写操作开始工作单元事务; 其余读取使用独立会话, 执行完即归还连接
+        """
+        if self.uow is not None and (write or self.uow.session is not None):
+            return self.uow.get_session()
+        return self.get_db()
+
+    def owned(self, session) -> bool:
+        return self.uow is None or session is not self.uow.session
+
+    def commit_session(self, session):
+        """
+        提交会话: 工作单元会话在请求结束时统一提交
+        """
+        if self.owned(session):
+            session.commit()
+
+    def close_session(self, session):
+        if self.owned(session):
+            session.close()
 
-    def execute(self, sql: str) -> list:
+    @classmethod
+    def pool_stats(cls) -> dict:
+        """
+        连接池状态
         """
-        :param sql: sql语句
+        return cls.MONITOR.stats()
+
+    @classmethod
+    def get_executor(cls):
+        """
+        执行sql的线程池, 并发数不超过连接池容量
+        """
+        if cls.EXECUTOR is None:
+            workers = min(SQLConfig.EXECUTOR_WORKERS, SQLConfig.POOL_SIZE + SQLConfig.MAX_OVERFLOW)
+            cls.EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sql')
+        return cls.EXECUTOR
+
+    @classmethod
+    def get_slots(cls) -> asyncio.Semaphore:
+        """
+        当前事件循环的连接槽, 数量为连接池容量
+        """
+        loop = asyncio.get_running_loop()
+        if cls.SLOTS is None or cls.SLOTS_LOOP is not loop:
+            cls.SLOTS = asyncio.Semaphore(SQLConfig.POOL_SIZE + SQLConfig.MAX_OVERFLOW)
+            cls.SLOTS_LOOP = loop
+        return cls.SLOTS
+
+    async def hold_slot(self, future_factory, *args):
+        """
+        占用一个连接槽执行, 执行结束(含调用方取消后线程执行完)时释放
+        """
+        slots = self.get_slots()
+        await slots.acquire()
+        try:
+            future = future_factory(*args)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    async def connect_async(self, func, *args, write=False):
+        """
+        在线程池中执行需要数据库连接的操作
+        工作单元的事务占用一个连接槽直到提交; 其他操作执行期间占用一个连接槽
+        """
+        uow = self.uow
+        if uow is not None and (write or uow.session is not None):
+            await uow.begin()
+            return await uow.track(self.run_async(func, *args))
+        return await (await self.hold_slot(self.run_async, func, *args))
+
+    async def execute_async(self, sql: str, binds: dict = None, shape='rows') -> Union[list, dict]:
+        """
+        在线程池中执行sql, 不阻塞事件循环; 相同的查询执行中时等待其结果
+        """
+        write = re.match(r'^\s*select', sql, re.IGNORECASE) is None
+        key = None if write else self.coalesce_key(sql, binds, shape)
+        if key is None:
+            return await self.connect_async(self.execute, sql, binds, shape, write=write)
+
+        flight = self.INFLIGHT.get(key)
+        if flight is not None:
+            self.COALESCE['coalesced'] += 1
+        else:
+            flight = await self.hold_slot(self.run_async, self.execute, sql, binds, shape)
+            self.INFLIGHT[key] = flight
+            self.COALESCE['executions'] += 1
+            flight.add_done_callback(lambda _: self.INFLIGHT.pop(key, None))
+        # 调用方取消时不影响其他等待者
+        res = await asyncio.shield(flight)
+        return self.copy_result(res)
+
+    def run_async(self, func, *args):
+        """
+        在线程池中执行阻塞的数据库操作, 返回 future
+        """
+        loop = asyncio.get_running_loop()
+        # 线程池中沿用当前上下文(路由等)
+        context = contextvars.copy_context()
+        return loop.run_in_executor(self.get_executor(), context.run, func, *args)
+
+    def coalesce_key(self, sql: str, binds: dict, shape):
+        """
+        查询合并键: 仅合并不加锁的 select; 工作单元有写入时不合并, 以读到本请求未提交的数据
+        """
+        if not conf.SQL_COALESCE_ENABLED or re.match(r'^\s*select', sql, re.IGNORECASE) is None:
+            return None
+        if re.search(r'\bfor\s+update\b', sql, re.IGNORECASE) is not None:
+            return None
+        if self.uow is not None and self.uow.written:
+            return None
+        return query_cache.make_key(sql, binds, shape)
+
+    @classmethod
+    def coalesce_stats(cls) -> dict:
+        return {**cls.COALESCE, 'inflight': len(cls.INFLIGHT)}
+
+    def execute(self, sql: str, binds: dict = None, shape='rows') -> Union[list, dict]:
+        """
+        :param sql: sql语句, 值以 :name 占位
+        :param binds: 绑定参数
+        :param shape: 查询结果形式, rows 字典列表; columns {"columns": [...], "rows": [[...]]}
         :return result_dict: 执行结果
         """
         statement = text(sql)
-        log.info(f'即将执行<{statement}>sql命令')
+        sampled = SQLLog.sampled()
+        if sampled:
+            log.info(f'即将执行<{statement}>sql命令, 参数: {SQLLog.describe_binds(binds)}')
+        start = time.perf_counter()
         if re.match(r'^select', sql, re.IGNORECASE) is not None:
-            res_dict_list = self.select_by_sql(statement)
-            log.info(f'查询结果: {res_dict_list}')
-            return res_dict_list
+            policy = self.cache_policy(sql)
+            key = query_cache.make_key(sql, binds, shape) if policy is not None else None
+            if key is not None:
+                cached = query_cache.get(key)
+                if cached is not None:
+                    if sampled:
+                        log.info(f'命中查询缓存: {SQLLog.count(cached)}条记录')
+                    return self.copy_result(cached)
+            version = query_cache.version(policy[1]) if key is not None else None
+            res = self.select_by_sql(statement, binds, shape)
+            if key is not None:
+                query_cache.set(key, self.copy_result(res), policy[1], policy[0], version)
+            label = '查询结果'
         elif re.match(r'^insert', sql, re.IGNORECASE) is not None:
-            res = self.insert_by_sql(statement)
-            log.info(f'插入的数据: {res}')
-            return res
+            res = self.insert_by_sql(statement, binds)
+            label = '插入的数据'
         elif re.match(r'^update', sql, re.IGNORECASE) is not None:
-            res = self.update_by_sql(statement)
-            log.info(f'更新的数据: {res}')
-            return res
+            res = self.update_by_sql(statement, binds)
+            label = '更新的数据'
         elif re.match(r'^delete', sql, re.IGNORECASE) is not None:
-            res = self.delete_real_by_sql(statement)
-            log.info(f'删除的数据: {res}')
-            return res
+            res = self.delete_real_by_sql(statement, binds)
+            label = '删除的数据'
         else:
             log.error(f'sql命令错误: 无对应操作')
             raise DBError('无对应操作方法')
 
-    def select_by_sql(self, statement) -> list:
-        session = self.get_db()
+        elapsed = time.perf_counter() - start
+        if elapsed > SQL_SLOW_THRESHOLD:
+            log.warning(f'慢查询({elapsed:.3f}s): <{sql}> 参数: {binds}')
+        if sampled:
+            log.info(f'{label}: {SQLLog.describe_result(res)}, 耗时{elapsed * 1000:.2f}ms')
+        return res
 
-        cursor = session.execute(statement)
-        result_tuples = cursor.fetchall()
+    def cache_policy(self, sql):
+        """
+        查询缓存策略: 主表模型设置了 __cache_ttl__, 且当前工作单元未写入涉及的表
+        :return: (ttl, 涉及的表) | None
+        """
+        tables = TABLE_PATTERN.findall(sql)
+        if not tables:
+            return None
+        model = ModelBase.get_model(tables[0])
+        ttl = getattr(model, '__cache_ttl__', None)
+        if not ttl:
+            return None
+        if self.uow is not None and self.uow.written.intersection(tables):
+            return None
+        return ttl, tuple(set(tables))
+
+    def invalidate(self, table):
+        """
+        写操作后失效该表的查询缓存; 工作单元内的写在提交后会再次失效
+        """
+        query_cache.invalidate(table)
+        if self.uow is not None:
+            self.uow.written.add(table)
+
+    @staticmethod
+    def rows_to_dicts(cursor) -> list:
         column_names = cursor.keys()
-        result_dict_list = [dict(zip(column_names, row)) for row in result_tuples]
+        return [dict(zip(column_names, row)) for row in cursor.fetchall()]
+
+    @staticmethod
+    def rows_to_columns(cursor) -> dict:
+        """
+        列式结果: 列名只出现一次, 每行为值元组, 不逐行构造字典
+        """
+        return {'columns': list(cursor.keys()), 'rows': [tuple(row) for row in cursor.fetchall()]}
+
+    @staticmethod
+    def copy_result(res):
+        """
+        拷贝查询结果(含每行), 避免调用方修改缓存或共享结果中的对象; 列式结果的行为元组, 不需拷贝
+        """
+        if isinstance(res, dict):
+            return {**res, 'columns': list(res['columns']), 'rows': list(res['rows'])}
+        return [dict(row) if isinstance(row, dict) else row for row in res]
+
+    def stream_by_sql(self, sql: str, binds: dict = None, style='ndjson', chunk_rows=None, shape='rows'):
+        """
+        服务端游标流式查询, 按块产出编码后的字节; 内存占用与结果集大小无关
+        使用独立会话(请求的工作单元在响应前已提交), 生成器结束或关闭时释放
+        :param style: ndjson 每行一条记录; json 增量编码的数组
+        :param shape: rows 每条记录为字典; columns 先输出列名, 每条记录为值数组
+        """
+        chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+        sampled = SQLLog.sampled()
+        if sampled:
+            log.info(f'即将流式执行<{sql}>sql命令, 参数: {SQLLog.describe_binds(binds)}')
+        start = time.perf_counter()
+        count = 0
+        session = self.get_db()
+        try:
+            cursor = session.execute(text(sql).execution_options(stream_results=True), binds or {})
+            column_names = list(cursor.keys())
+            columnar = shape == 'columns'
+            if style == 'json':
+                yield b'{"columns":' + JsonTool.dumps(column_names) + b',"rows":[' if columnar else b'['
+            elif columnar:
+                yield JsonTool.dumps(column_names) + b'\n'
+            dumps = JsonTool.dumps
+            for rows in cursor.partitions(chunk_rows):
+                if columnar:
+                    lines = [dumps(tuple(row)) for row in rows]
+                else:
+                    lines = [dumps(dict(zip(column_names, row))) for row in rows]
+                if style == 'json':
+                    chunk = (b',' if count else b'') + b','.join(lines)
+                else:
+                    chunk = b'\n'.join(lines) + b'\n'
+                count += len(rows)
+                yield chunk
+            if style == 'json':
+                yield b']}' if columnar else b']'
+            cursor.close()
+        finally:
+            session.close()
+            elapsed = time.perf_counter() - start
+            if elapsed > SQL_SLOW_THRESHOLD:
+                log.warning(f'慢查询({elapsed:.3f}s): <{sql}> 参数: {binds}')
+            if sampled:
+                log.info(f'流式查询结果: {count}条记录, 耗时{elapsed * 1000:.2f}ms')
+
+    async def stream_async(self, sql: str, binds: dict = None, style='ndjson', shape='rows'):
+        """
+        在线程池中逐块拉取流式查询结果
+        """
+        loop = asyncio.get_running_loop()
+        slots = self.get_slots()
+        await slots.acquire()
+        chunks = self.stream_by_sql(sql, binds, style, shape=shape)
+        pulling = None
+        try:
+            while True:
+                pulling = loop.run_in_executor(self.get_executor(), next, chunks, None)
+                chunk = await asyncio.shield(pulling)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            try:
+                # 被取消时线程可能仍在执行 next, 须等其结束才能关闭生成器(释放游标及会话)
+                if pulling is not None and not pulling.done():
+                    await asyncio.wait([pulling])
+                await loop.run_in_executor(self.get_executor(), chunks.close)
+            finally:
+                slots.release()
+
+    def select_by_sql(self, statement, binds: dict = None, shape='rows') -> Union[list, dict]:
+        session = self.open_session()
+
+        cursor = session.execute(statement, binds or {})
+        if shape == 'columns':
+            result_dict_list = self.rows_to_columns(cursor)
+        else:
+            result_dict_list = self.rows_to_dicts(cursor)
         # print(result_dict)
 
         cursor.close()
-        session.close()
+        self.close_session(session)
         return result_dict_list
 
-    def select_last_update(self, table):
+    def supports_returning(self, way) -> bool:
         """
-        获取最新更新的记录
+        当前数据库方言是否支持 insert/update/delete ... RETURNING
         """
-        sql = f'select * from {table} order by utime desc limit 1'
-        return self.execute(sql)
+        return getattr(self.get_engine().dialect, f'{way}_returning', False)
 
-    def sql_operation(self, statement, table):
+    def lock_suffix(self) -> str:
         """
-        执行更新操作
+        行锁后缀, sqlite 不支持 FOR UPDATE
         """
-        session = self.get_db()
+        return '' if self.get_engine().dialect.name == 'sqlite' else ' FOR UPDATE'
+
+    @staticmethod
+    def returned_keys(table) -> str:
+        """
+        写操作返回的字段: 模型的默认投影, 排除字段不返回; 未注册模型时为 *
+        """
+        model = ModelBase.get_model(table)
+        if model is None:
+            return '*'
+        return ', '.join(f'`{name}`' for name in model.get_default_fields())
+
+    @staticmethod
+    def primary_key(table) -> str:
+        """
+        表的主键字段, 未注册模型时默认 id
+        """
+        model = ModelBase.get_model(table)
+        return model.get_primary_key()[0] if model is not None else 'id'
+
+    @staticmethod
+    def split_where(sql) -> str:
+        """
+        截取sql的 where 条件
+        """
+        parts = re.split(r'\swhere\s', sql, maxsplit=1, flags=re.IGNORECASE)
+        return parts[1] if len(parts) > 1 else None
+
+    def select_for_write(self, session, table, keys, where, binds=None) -> list:
+        """
+        加锁读取将被写入的记录
+        """
+        sql = f'SELECT {keys} FROM `{table}`'
+        if where:
+            sql += f' WHERE {where}'
+        return self.rows_to_dicts(session.execute(text(sql + self.lock_suffix()), binds or {}))
+
+    def select_by_keys(self, session, table, pk, keys) -> list:
+        """
+        按主键回查记录
+        """
+        if not keys:
+            return []
+        binds = {f'k{i}': key for i, key in enumerate(keys)}
+        sql = f'SELECT {self.returned_keys(table)} FROM `{table}` WHERE `{pk}` IN ({", ".join(f":{name}" for name in binds)})'
+        return self.rows_to_dicts(session.execute(text(sql), binds))
+
+    def sql_operation(self, statement, table, way='update', binds=None):
+        """
+        执行写操作, 返回受影响的记录
+        支持 RETURNING 时直接返回; 否则插入按 lastrowid、更新按加锁读取的主键回查
+        """
+        session = self.open_session(write=True)
         try:
-            res = session.execute(statement)
-            log.info(f'操作了{res.rowcount}条记录')
-            session.commit()
-            return self.select_last_update(table)
+            rows = self.write_rows(session, str(statement), table, way, binds)
+            self.commit_session(session)
+            self.invalidate(table)
+            return rows
         except Exception as e:
             log.error(f'数据库执行异常: {e}')
             session.rollback()
             raise DBError('数据库执行异常')
         finally:
-            session.close()
+            self.close_session(session)
+
+    def write_rows(self, session, sql: str, table, way='update', binds=None) -> list:
+        """
+        在给定会话中执行写操作(不提交), 返回受影响的记录
+        """
+        binds = binds or {}
+        sql = sql.rstrip().rstrip(';')
+        if self.supports_returning(way):
+            rows = self.rows_to_dicts(session.execute(text(f'{sql} RETURNING {self.returned_keys(table)}'), binds))
+            log.info(f'操作了{len(rows)}条记录')
+            return rows
+        pk = self.primary_key(table)
+        if way == 'insert':
+            res = session.execute(text(sql), binds)
+            keys = [res.lastrowid]
+        else:
+            targets = self.select_for_write(session, table, f'`{pk}`', self.split_where(sql), binds)
+            keys = [row[pk] for row in targets]
+            res = session.execute(text(sql), binds)
+        log.info(f'操作了{res.rowcount}条记录')
+        return self.select_by_keys(session, table, pk, keys)
 
-    def insert_by_sql(self, statement):
+    def insert_by_sql(self, statement, binds=None):
         table = re.findall(r'into `(.*?)`', str(statement), re.IGNORECASE)[0]
-        return self.sql_operation(statement, table)
+        return self.sql_operation(statement, table, 'insert', binds)
 
-    def update_by_sql(self, statement):
+    def bulk_insert_by_sql(self, sql: str, binds=None, way='insert') -> dict:
+        """
+        多行插入(含 upsert): 支持 RETURNING 时返回插入/更新的记录; 否则只返回条数, 不再按 lastrowid 回查
+        不支持 RETURNING 时 upsert 的 rowcount 为受影响行数(MySQL: 插入计1、更新计2、未变化计0),
+        无法区分插入与更新的条数, 以 affected 返回, count 为 None
+        :return: {'count': 条数 | None, 'data': 记录 | None[, 'affected': 受影响行数]}
+        """
+        sql = sql.rstrip().rstrip(';')
+        table = re.findall(r'into `(.*?)`', sql, re.IGNORECASE)[0]
+        sampled = SQLLog.sampled()
+        start = time.perf_counter()
+        session = self.open_session(write=True)
+        try:
+            if self.supports_returning('insert'):
+                rows = self.rows_to_dicts(
+                    session.execute(text(f'{sql} RETURNING {self.returned_keys(table)}'), binds or {}))
+                count = len(rows)
+            else:
+                rows = None
+                count = session.execute(text(sql), binds or {}).rowcount
+            self.commit_session(session)
+            self.invalidate(table)
+        except Exception as e:
+            log.error(f'数据库执行异常: {e}')
+            session.rollback()
+            raise DBError('数据库执行异常')
+        finally:
+            self.close_session(session)
+        if rows is None and way == 'upsert':
+            if sampled:
+                log.info(f'upsert {table}: 受影响{count}行, 耗时{(time.perf_counter() - start) * 1000:.2f}ms')
+            return {'count': None, 'data': None, 'affected': count}
+        if sampled:
+            log.info(f'多行插入{table}: {count}条记录, 耗时{(time.perf_counter() - start) * 1000:.2f}ms')
+        return {'count': count, 'data': rows}
+
+    def update_by_sql(self, statement, binds=None):
         table = re.findall(r'update `(.*?)`', str(statement), re.IGNORECASE)[0]
-        return self.sql_operation(statement, table)
+        return self.sql_operation(statement, table, 'update', binds)
 
-    def delete_real_by_sql(self, statement):
-        sql = re.sub(r'delete|DELETE', 'select *', str(statement))
-        # 将被真删的数据
-        op_target = self.execute(sql)
-        session = self.get_db()
+    def delete_real_by_sql(self, statement, binds=None):
+        """
+        真删除, 返回被删除的记录
+        支持 RETURNING 时一条语句完成; 否则加锁读取后按主键删除
+        """
+        sql = str(statement).rstrip().rstrip(';')
+        table = re.findall(r'from `(.*?)`', sql, re.IGNORECASE)[0]
+        session = self.open_session(write=True)
         try:
-            session.execute(statement)
-            session.commit()
+            returned = self.returned_keys(table)
+            if self.supports_returning('delete'):
+                op_target = self.rows_to_dicts(session.execute(text(f'{sql} RETURNING {returned}'), binds or {}))
+            else:
+                # 将被真删的数据(含主键, 按主键删除)
+                pk = self.primary_key(table)
+                if returned != '*' and f'`{pk}`' not in returned.split(', '):
+                    returned = f'{returned}, `{pk}`'
+                op_target = self.select_for_write(session, table, returned, self.split_where(sql), binds)
+                keys = [row[pk] for row in op_target]
+                if keys:
+                    binds = {f'k{i}': key for i, key in enumerate(keys)}
+                    session.execute(text(
+                        f'DELETE FROM `{table}` WHERE `{pk}` IN ({", ".join(f":{name}" for name in binds)})'), binds)
+            self.commit_session(session)
+            self.invalidate(table)
             return op_target
         except Exception as e:
             log.error(f'数据库执行异常: {e}')
             session.rollback()
             raise DBError('数据库执行异常')
         finally:
-            session.close()
+            self.close_session(session)
 
-    def mock_delete_by_sql(self, statement):
+    def mock_delete_by_sql(self, statement, binds=None):
         sql = re.sub(r'delete|DELETE ', 'update', str(statement))
         sql = re.sub(r'from|FROM', '', sql)
         if not re.match(r'[\S\s]*where[\S\s]*', sql, re.IGNORECASE):
             raise DBError('删除必须要有where')
         sql = re.sub(r'where|WHERE', 'set status = 0 where', sql)
-        return self.update_by_sql(sql)
+        return self.update_by_sql(sql, binds)
 
     def insert_model(self, data: Union[list, ModelBase]):
-        session = self.get_db()
+        session = self.open_session(write=True)
         try:
             if isinstance(data, list):
                 session.add_all(data)
@@ -242,12 +774,14 @@ class SQLServer:
                 session.add(data)
             else:
                 raise TypeError
-            session.commit()
+            self.commit_session(session)
+            for table in {item.get_table_name() for item in (data if isinstance(data, list) else [data])}:
+                self.invalidate(table)
         except Exception as err:
             session.rollback()
             log.error(f'插入失败,原因:{err}')
         finally:
-            session.close()
+            self.close_session(session)
 
     def delete_model(self, model):
         """
@@ -256,24 +790,141 @@ class SQLServer:
         :return:
         """
         delete_statement = delete(model)
-        session = self.get_db()
+        session = self.open_session(write=True)
         try:
             session.execute(delete_statement)
-            session.commit()
+            self.commit_session(session)
+            self.invalidate(model.get_table_name())
             log.success(f'{model.__tablename__}数据表已清空')
         except Exception as err:
             session.rollback()
             log.error(f"清空{model.__tablename__}表时发生错误: {err}")
         finally:
-            session.close()
+            self.close_session(session)
 
     def update_instance(self, instance):
-        session = self.get_db()
+        session = self.open_session(write=True)
         session.add(instance)
-        session.commit()
-        session.close()
+        self.commit_session(session)
+        self.close_session(session)
+        self.invalidate(instance.get_table_name())
 
     def model_is_exist(self, model):
-        session = self.get_db()
+        session = self.open_session()
         flag = session.query(model).first()
+        self.close_session(session)
         return True if flag is not None else False
+
+
+class UnitOfWork:
+    """
+    请求级工作单元: 首次写入时开始事务, 之后的sql共用该会话, 请求结束时统一提交
+    只读的请求不占用连接; 开始事务后占用一个连接槽直到提交或回滚
+    """
+
+    def __init__(self):
+        self.session = None
+        # 本次请求写入过的表, 提交后失效其查询缓存
+        self.written = set()
+        self.slots = None
+        # 执行中的语句, 提交/回滚前等待其结束(会话不能跨线程并发使用)
+        self.running = None
+        # 提交/回滚后在线程池中执行的回调(如上传文件的存放或清理)
+        self.callbacks = {'commit': [], 'rollback': []}
+
+    def on_commit(self, func):
+        self.callbacks['commit'].append(func)
+
+    def on_rollback(self, func):
+        self.callbacks['rollback'].append(func)
+
+    def run_callbacks(self, kind):
+        callbacks = self.callbacks[kind]
+        self.callbacks = {'commit': [], 'rollback': []}
+        for func in callbacks:
+            try:
+                func()
+            except Exception as e:
+                log.error(f'工作单元{kind}回调异常: {e}')
+
+    async def begin(self):
+        """
+        占用连接槽, 每个工作单元只占用一次
+        """
+        if self.slots is None:
+            slots = SQLServer.get_slots()
+            await slots.acquire()
+            self.slots = slots
+
+    def release(self):
+        if self.slots is not None:
+            self.slots.release()
+            self.slots = None
+
+    def track(self, future):
+        self.running = future
+        return future
+
+    async def settle(self):
+        """
+        等待执行中的语句结束
+        """
+        running, self.running = self.running, None
+        if running is not None and not running.done():
+            await asyncio.wait([running])
+
+    def get_session(self):
+        if self.session is None:
+            self.session = SQLServer.get_db()
+        return self.session
+
+    def commit(self, session):
+        try:
+            session.commit()
+            for table in self.written:
+                query_cache.invalidate(table)
+        except Exception:
+            self.run_callbacks('rollback')
+            raise
+        finally:
+            self.written.clear()
+            session.close()
+        self.run_callbacks('commit')
+
+    def rollback(self, session):
+        try:
+            session.rollback()
+        finally:
+            self.written.clear()
+            session.close()
+            self.run_callbacks('rollback')
+
+    async def finish(self, kind):
+        """
+        提交(commit)或回滚(rollback)并关闭会话; 线程执行完后才释放连接槽
+        """
+        if self.session is None:
+            self.release()
+            # 未开始事务时仍执行回调
+            if self.callbacks[kind]:
+                await asyncio.get_running_loop().run_in_executor(SQLServer.get_executor(), self.run_callbacks, kind)
+            return
+        await self.settle()
+        session, self.session = self.session, None
+        loop = asyncio.get_running_loop()
+        func = self.commit if kind == 'commit' else self.rollback
+        future = loop.run_in_executor(SQLServer.get_executor(), func, session)
+        future.add_done_callback(lambda _: self.release())
+        await future
+
+    async def complete(self):
+        """
+        提交并释放连接
+        """
+        await self.finish('commit')
+
+    async def abort(self):
+        """
+        回滚并释放连接; 已提交时无操作. 调用方被取消(如客户端断开)时回滚仍会完成
+        """
+        await asyncio.shield(self.finish('rollback'))
@@ -0,0 +1,90 @@
+import importlib
+import time
+
+from src import conf
+from src.library.error import ResourceError
+
+
+class MiddlewarePipeline:
+    """
+    中间件链: 启动时实例化一次, 预先收集各阶段存在的钩子
+    """
+    HOOKS = ('before_request', 'after_request', 'before_resposne', 'after_response', 'deal_exception')
+
+    def __init__(self, middlewares=None):
+        self.middlewares = middlewares
+        self.hooks = {hook: [] for hook in self.HOOKS}
+        # (中间件, 钩子) -> [调用次数, 总耗时, 最大耗时]
+        self.timing = {}
+        self.compiled = False
+
+    @staticmethod
+    def instantiate_middleware(middleware: str):
+        """
+        实例化中间件
+        """
+        parts = middleware.split('.')
+        module_name = '.'.join(parts[:-1])
+        class_name = parts[-1]
+        try:
+            module = importlib.import_module(module_name)
+            return getattr(module, class_name)()
+        except Exception as e:
+            raise ResourceError(f'中间件异常: {e}')
+
+    def build(self):
+        """
+        编译中间件链
+        """
+        hooks = {hook: [] for hook in self.HOOKS}
+        for middleware in self.middlewares or conf.MIDDLEWARES:
+            ware = self.instantiate_middleware(middleware)
+            name = middleware.split('.')[-1]
+            for hook in self.HOOKS:
+                func = getattr(ware, hook, None)
+                if func is not None:
+                    hooks[hook].append((name, func))
+        self.hooks = hooks
+        self.compiled = True
+        return self
+
+    def record(self, name, hook, elapsed):
+        """
+        记录钩子耗时
+        """
+        stat = self.timing.get((name, hook))
+        if stat is None:
+            stat = self.timing[(name, hook)] = [0, 0.0, 0.0]
+        stat[0] += 1
+        stat[1] += elapsed
+        if elapsed > stat[2]:
+            stat[2] = elapsed
+        if elapsed > conf.MIDDLEWARE_SLOW_THRESHOLD:
+            conf.log.warning(f'中间件耗时过长: {name}.{hook} {elapsed * 1000:.2f}ms')
+
+    async def call(self, name, hook, func, *args):
+        """
+        执行钩子并计时
+        """
+        start = time.perf_counter()
+        try:
+            return await func(*args)
+        finally:
+            self.record(name, hook, time.perf_counter() - start)
+
+    def stats(self):
+        """
+        各中间件钩子耗时统计(毫秒)
+        """
+        res = {}
+        for (name, hook), (count, total, peak) in self.timing.items():
+            res.setdefault(name, {})[hook] = {
+                'count': count,
+                'avg_ms': round(total / count * 1000, 3),
+                'max_ms': round(peak * 1000, 3),
+                'total_ms': round(total * 1000, 3),
+            }
+        return res
+
+
+pipeline = MiddlewarePipeline()
@@ -0,0 +1,133 @@
+import importlib
+import os
+import sys
+import time
+
+from src import conf
+from src.library.error import ResourceError
+from src.utils.tools import ContentTool
+
+
+class Route:
+    """
+    路由表项: 共享的控制器实例、动作名及允许的请求方法
+    """
+    __slots__ = ('instance', 'action', 'method', 'handler')
+
+    def __init__(self, instance, action, method, attr=None):
+        self.instance = instance
+        self.action = action
+        self.method = method
+        self.handler = getattr(instance, attr or action)
+
+
+class Router:
+    """
+    路由表: 启动时扫描 <module>/controller/*.py, 编译为 (module, resource, action) -> Route
+    """
+    # 调试模式下检查控制器文件变动的最小间隔(秒)
+    RELOAD_INTERVAL = 1
+
+    def __init__(self, base_dir=None):
+        self.base_dir = base_dir
+        self.routes = {}
+        self.modules = set()
+        self.resources = set()
+        self.snapshot = {}
+        self.checked = 0
+
+    def scan(self):
+        """
+        扫描控制器文件
+        :return: {文件路径: (module, resource, 修改时间)}
+        """
+        base_dir = str(self.base_dir or conf.BASE_DIR)
+        files = {}
+        for module in os.listdir(base_dir):
+            path = os.path.join(base_dir, module, 'controller')
+            if not os.path.isdir(path):
+                continue
+            for entry in os.scandir(path):
+                if entry.name.endswith('.py') and not entry.name.startswith('__') and entry.is_file():
+                    files[entry.path] = (module, entry.name[:-3], entry.stat().st_mtime)
+        return files
+
+    @staticmethod
+    def load_module(name, reload=False):
+        """
+        导入控制器模块, 文件变动时重新加载
+        """
+        if reload and name in sys.modules:
+            return importlib.reload(sys.modules[name])
+        return importlib.import_module(name)
+
+    def build(self):
+        """
+        构建路由表
+        """
+        files = self.scan()
+        routes, modules, resources = {}, set(), set()
+        for path, (module, resource, mtime) in files.items():
+            modules.add(module)
+            resources.add((module, resource))
+
+            previous = self.snapshot.get(path)
+            reload = previous is not None and previous[2] != mtime
+            ctrl_module = self.load_module(f'{module}.controller.{resource}', reload)
+            ctrl_name = ContentTool(resource).multiword_construct(delimiter='_')
+            ctrl_class = getattr(ctrl_module, f'{ctrl_name}Ctrl', None)
+            if ctrl_class is None:
+                conf.log.warning(f'路由注册跳过: {module}.controller.{resource} 中不存在 {ctrl_name}Ctrl')
+                continue
+
+            # 控制器无请求状态, 每个资源只实例化一次
+            instance = ctrl_class()
+            for name in dir(ctrl_class):
+                if name.startswith('_'):
+                    continue
+                func = getattr(ctrl_class, name)
+                if callable(func) and func.__name__ == 'method_allow':
+                    action = getattr(func, 'action', None) or name
+                    routes[(module, resource, action)] = Route(instance, action, func.method, name)
+
+        self.routes, self.modules, self.resources = routes, modules, resources
+        self.snapshot = files
+        self.checked = time.monotonic()
+        conf.log.info(f'路由表已构建: {len(routes)}个接口')
+        return self
+
+    def refresh(self):
+        """
+        [调试模式]控制器文件变动时重建路由表
+        """
+        now = time.monotonic()
+        if now - self.checked < self.RELOAD_INTERVAL:
+            return
+        self.checked = now
+        if self.scan() != self.snapshot:
+            self.build()
+
+    def resolve(self, module, resource, action, method=None) -> Route:
+        """
+        路由查找, 指定 method 时校验请求方法
+        """
+        if conf.DEBUG:
+            self.refresh()
+        elif not self.snapshot:
+            self.build()
+
+        resource = resource.replace('-', '_')
+        route = self.routes.get((module, resource, action))
+        if route is not None:
+            if method is not None and method != route.method:
+                raise ResourceError('Method not allowed.', status_code=405, headers={'Allow': route.method})
+            return route
+
+        if module not in self.modules:
+            raise ResourceError('Module does not exist.')
+        if (module, resource) not in self.resources:
+            raise ResourceError('Resource does not exist.', status_code=404)
+        raise ResourceError('Action does not exist.', status_code=405)
+
+
+router = Router()
@@ -0,0 +1,421 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from src import conf
+from src.library.error import ParamError
+
+# 整数字符串
+INTEGER = re.compile(r'[+-]?\d+')
+# 函数包裹的字段, 如 COUNT(id)
+FUNCTION = re.compile(r'^[a-zA-Z]*\((?P<key>.*)\)$')
+# 条件运算符, 与 QueryBuild 保持一致
+OPERATORS = ('eq', 'neq', 'lt', 'lte', 'gt', 'gte', 'like', 'rlike', 'ex', 'between', 'in')
+# 排序方向
+DIRECTIONS = ('asc', 'desc')
+# 表别名
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+# 投影字段: 字段 或 表名/别名.字段
+FIELD = re.compile(r'(?:[A-Za-z_][A-Za-z0-9_]*\.)?[A-Za-z_][A-Za-z0-9_]*')
+
+
+def to_int(value):
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and INTEGER.fullmatch(value.strip()):
+        return int(value)
+    raise ValueError
+
+
+def to_float(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError
+    return float(value)
+
+
+def to_decimal(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str, Decimal)):
+        raise ValueError
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError
+
+
+def to_str(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value in (0, 1):
+        return bool(value)
+    raise ValueError
+
+
+# python类型 -> (转换函数, 类型描述)
+COERCERS = {
+    int: (to_int, '整数'),
+    float: (to_float, '浮点数'),
+    Decimal: (to_decimal, '数值'),
+    str: (to_str, '字符串'),
+    bool: (to_bool, '布尔值'),
+}
+
+
+class ModelSchema:
+    """
+    模型的字段元数据及预编译的参数校验/转换器, 启动时由模型列定义生成
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.table = model.get_table_name()
+        self.primary_key = model.get_primary_key()
+        # 字段 -> (转换函数, 类型描述)
+        self.columns = {name: self.compile_column(column) for name, column in model.__table__.columns.items()}
+        # 可为 NULL 的字段
+        self.nullable = frozenset(name for name, column in model.__table__.columns.items() if column.nullable)
+        # 不允许查询返回的字段及默认投影
+        self.excluded = frozenset(model.__exclude_fields__)
+        self.default_fields = self.check_fields(model.get_default_fields())
+        # 各操作的校验器
+        self.validators = {
+            'select': self.validate_select,
+            'insert': self.validate_insert,
+            'upsert': self.validate_upsert,
+            'update': self.validate_update,
+            'delete': self.validate_delete,
+        }
+
+    @staticmethod
+    def compile_column(column):
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            return None, None
+        return COERCERS.get(python_type, (None, None))
+
+    def column(self, name, tables=None):
+        """
+        解析查询/条件中的字段名(支持 表名或别名.字段、函数(字段)、*), 返回转换器
+        未知的表或字段、排除字段及含排除字段的表的 * 抛出 ParamError
+        :param tables: 表名/别名 -> schema, 见 related
+        """
+        if not isinstance(name, str):
+            raise ParamError(f'字段名须为字符串: {name}')
+        match = FUNCTION.match(name)
+        if match is not None:
+            name = match.group('key')
+        schema = self
+        if '.' in name:
+            qualifier, name = name.rsplit('.', 1)
+            schema = (tables or {self.table: self}).get(qualifier)
+            if schema is None:
+                raise ParamError(f'未知的表或别名: {qualifier}')
+        if name == '*':
+            if schema.excluded and match is None:
+                raise ParamError(f'{schema.table} 含不允许查询的字段, 请指定字段')
+            return None, None
+        if name not in schema.columns:
+            raise ParamError(f'{schema.table} 不存在字段: {name}')
+        if name in schema.excluded:
+            raise ParamError(f'{schema.table} 不允许查询字段: {name}')
+        return schema.columns[name]
+
+    def check_fields(self, fields) -> list:
+        for name in fields:
+            if name not in self.columns:
+                raise ParamError(f'{self.table} 不存在字段: {name}')
+            if name in self.excluded:
+                raise ParamError(f'{self.table} 不允许查询字段: {name}')
+        return list(fields)
+
+    def projection(self, fields=None, params=None) -> list:
+        """
+        查询返回的字段: fields 为逗号分隔的字符串或列表(字段或 表名/别名.字段), 未指定时使用模型默认投影
+        有 join 时未限定的字段按主表限定, 避免与关联表同名字段冲突
+        """
+        tables = self.related(params) if params and (params.get('joins') or params.get('join')) else None
+        qualifier = ((params or {}).get('base') or {}).get('alias') or self.table
+        if fields is None or fields == '':
+            fields = list(self.default_fields)
+        else:
+            if isinstance(fields, str):
+                fields = [name.strip() for name in fields.split(',') if name.strip()]
+            elif not isinstance(fields, list):
+                raise ParamError('fields 须为逗号分隔的字段名或列表')
+            fields = list(dict.fromkeys(fields))
+            for name in fields:
+                if not isinstance(name, str) or FIELD.fullmatch(name) is None:
+                    raise ParamError(f'不合法的字段名: {name}')
+                if '.' in name:
+                    self.column(name, tables)
+                else:
+                    self.check_fields([name])
+        if tables is None:
+            return fields
+        return [name if '.' in name else f'{qualifier}.{name}' for name in fields]
+
+    def coerce(self, name, value, tables=None):
+        """
+        将条件值转换为字段类型, None 保持不变
+        """
+        return self.convert(name, value, self.column(name, tables))
+
+    @staticmethod
+    def convert(name, value, converter):
+        func, label = converter
+        if func is None or value is None:
+            return value
+        try:
+            return func(value)
+        except (ValueError, TypeError):
+            raise ParamError(f'字段 {name} 应为{label}')
+
+    def coerce_relation(self, name, relation: dict, tables=None):
+        """
+        转换比较条件 {运算符: 值}
+        """
+        res = {}
+        for compare, value in relation.items():
+            operator = str(compare).lower()
+            if operator not in OPERATORS:
+                raise ParamError(f'不支持的比较运算符: {compare}')
+            if operator == 'ex':
+                res[compare] = value
+            elif operator in ('in', 'between'):
+                if not isinstance(value, list):
+                    raise ParamError(f'{compare} 条件的值须为列表')
+                res[compare] = [self.coerce(name, item, tables) for item in value]
+            elif operator in ('like', 'rlike'):
+                res[compare] = value if isinstance(value, str) else self.coerce(name, value, tables)
+            else:
+                res[compare] = self.coerce(name, value, tables)
+        return res
+
+    def coerce_where(self, where, tables=None) -> dict:
+        if not isinstance(where, dict):
+            raise ParamError('where 须为对象')
+        res = {}
+        for key, value in where.items():
+            if key in ('and', 'or') and isinstance(value, dict):
+                res[key] = self.coerce_where(value, tables)
+            elif isinstance(value, dict):
+                res[key] = self.coerce_relation(key, value, tables)
+            else:
+                res[key] = self.coerce(key, value, tables)
+        return res
+
+    def coerce_values(self, values) -> dict:
+        if not isinstance(values, dict) or not values:
+            raise ParamError('values 须为非空对象')
+        # 写入的值可包含排除字段(如密码), 只是不允许查询返回
+        self.check_columns(values)
+        return {key: self.convert(key, value, self.columns[key]) for key, value in values.items()}
+
+    def check_columns(self, names):
+        for name in names:
+            if name not in self.columns:
+                raise ParamError(f'{self.table} 不存在字段: {name}')
+
+    def check_names(self, names, tables=None):
+        for name in names:
+            if isinstance(name, (list, tuple)):
+                name = name[0]
+            self.column(name, tables)
+
+    def check_order(self, orders, tables=None) -> list:
+        """
+        排序: 字段名或 [字段名, asc/desc], 方向统一为小写
+        """
+        res = []
+        for order in orders:
+            if isinstance(order, (list, tuple)):
+                if len(order) != 2 or not isinstance(order[1], str) or order[1].lower() not in DIRECTIONS:
+                    raise ParamError(f'排序须为字段名或 [字段名, asc/desc]: {order}')
+                self.column(order[0], tables)
+                res.append((order[0], order[1].lower()))
+            else:
+                self.column(order, tables)
+                res.append(order)
+        return res
+
+    def related(self, params) -> dict:
+        """
+        参数涉及的表(主表及join表): 表名/别名 -> schema, 用于校验 表名或别名.字段
+        join 只允许已注册模型的表, on 条件按各表 schema 校验
+        """
+        tables = {self.table: self}
+        alias = (params.get('base') or {}).get('alias')
+        if alias:
+            tables[alias] = self
+        joins = []
+        for key in ('joins', 'join'):
+            items = params.get(key) or []
+            if not isinstance(items, list):
+                raise ParamError(f'{key} 须为列表')
+            joins += items
+        for join in joins:
+            if not isinstance(join, dict):
+                raise ParamError('join 须为对象')
+            schema = registry.get_table(join.get('table'))
+            if schema is None:
+                raise ParamError(f'不允许关联的表: {join.get("table")}')
+            tables[schema.table] = schema
+            alias = join.get('alias')
+            if alias:
+                if not isinstance(alias, str) or IDENTIFIER.fullmatch(alias) is None:
+                    raise ParamError(f'不合法的表别名: {alias}')
+                tables[alias] = schema
+        for join in joins:
+            self.check_on(join.get('on'), tables)
+        return tables
+
+    def check_on(self, on, tables):
+        """
+        join 的 on 条件: 左值为字段, 右值为字段或比较条件
+        """
+        if not isinstance(on, dict) or not on:
+            raise ParamError('join 须指定 on 条件')
+        for key, value in on.items():
+            if key in ('and', 'or') and isinstance(value, dict):
+                self.check_on(value, tables)
+                continue
+            self.column(key, tables)
+            if isinstance(value, dict):
+                self.coerce_relation(key, value, tables)
+            elif value is not None:
+                self.column(value, tables)
+
+    def check_having(self, having, tables):
+        """
+        having 条件: 校验字段(可为聚合函数)及运算符, 值不按字段类型转换
+        """
+        if not isinstance(having, dict):
+            raise ParamError('having 须为对象')
+        for key, value in having.items():
+            if key in ('and', 'or') and isinstance(value, dict):
+                self.check_having(value, tables)
+                continue
+            self.column(key, tables)
+            if isinstance(value, dict):
+                for compare in value:
+                    if str(compare).lower() not in OPERATORS:
+                        raise ParamError(f'不支持的比较运算符: {compare}')
+
+    @staticmethod
+    def check_page(params):
+        for key in ('limit', 'offset'):
+            value = params.get(key)
+            if value is None:
+                continue
+            try:
+                value = to_int(value)
+            except ValueError:
+                raise ParamError(f'{key} 应为整数')
+            if value < 0:
+                raise ParamError(f'{key} 不能为负数')
+            params[key] = value
+
+    def validate_select(self, params: dict) -> dict:
+        tables = self.related(params)
+        if params.get('where'):
+            params['where'] = self.coerce_where(params['where'], tables)
+        if params.get('having'):
+            self.check_having(params['having'], tables)
+        for key in ('keys', 'group', 'order'):
+            names = params.get(key)
+            if names:
+                if not isinstance(names, list):
+                    raise ParamError(f'{key} 须为列表')
+                if key == 'order':
+                    params[key] = self.check_order(names, tables)
+                else:
+                    self.check_names(names, tables)
+        seek = params.get('seek')
+        if seek:
+            seek['values'] = [self.coerce(key, value) for key, value in zip(seek['keys'], seek['values'])]
+        self.check_page(params)
+        return params
+
+    def validate_insert(self, params: dict) -> dict:
+        values = params.get('values')
+        if isinstance(values, list):
+            if not values:
+                raise ParamError('values 须为非空对象或列表')
+            rows = [self.coerce_values(row) for row in values]
+            if any(row.keys() != rows[0].keys() for row in rows):
+                raise ParamError('多行插入的各行字段须一致')
+            params['values'] = rows
+        else:
+            params['values'] = self.coerce_values(values)
+        return params
+
+    def validate_upsert(self, params: dict) -> dict:
+        self.validate_insert(params)
+        upsert = params.get('upsert') or {}
+        for key in ('keys', 'update'):
+            names = upsert.get(key) or []
+            if not isinstance(names, list):
+                raise ParamError(f'upsert.{key} 须为列表')
+            self.check_columns(names)
+        return params
+
+    def validate_update(self, params: dict) -> dict:
+        params['values'] = self.coerce_values(params.get('values'))
+        return self.validate_delete(params)
+
+    def validate_delete(self, params: dict) -> dict:
+        if params.get('where'):
+            params['where'] = self.coerce_where(params['where'])
+        return params
+
+    def validate(self, way, params: dict) -> dict:
+        """
+        构造sql前校验参数: 拒绝未知字段, 值转换为字段类型
+        """
+        validator = self.validators.get(way)
+        return validator(params) if validator is not None else params
+
+
+class SchemaRegistry:
+    """
+    模型 schema 注册表: 启动时为所有 ModelBase 子类编译, 请求中不再反射模型
+    """
+
+    def __init__(self):
+        self.schemas = {}
+        self.tables = {}
+
+    def register(self, model):
+        schema = ModelSchema(model)
+        self.schemas[model] = schema
+        self.tables[schema.table] = schema
+        return schema
+
+    def build(self):
+        from src.library.model import Base, ModelBase
+        for mapper in Base.registry.mappers:
+            if issubclass(mapper.class_, ModelBase) and mapper.class_ not in self.schemas:
+                self.register(mapper.class_)
+        conf.log.info(f'模型schema已编译: {len(self.schemas)}个')
+        return self
+
+    def get(self, model) -> ModelSchema:
+        schema = self.schemas.get(model)
+        return schema if schema is not None else self.register(model)
+
+    def get_table(self, table):
+        return self.tables.get(table)
+
+
+registry = SchemaRegistry()
@@ -0,0 +1,69 @@
+import random
+
+from src import conf
+from src.library.context import current_route
+
+
+class SQLLog:
+    """
+    sql日志: 按路由采样; 结果默认只记录条数, 预览有字节上限; 慢查询总是记录完整语句
+    日志开销不随结果集大小增长
+    """
+
+    @staticmethod
+    def sampled() -> bool:
+        """
+        当前路由的sql日志是否采样
+        """
+        rate = conf.SQL_LOG_SAMPLE_RATE
+        route = current_route.get()
+        if route is not None:
+            rate = conf.SQL_LOG_ROUTE_SAMPLE_RATES.get(route, rate)
+        return rate >= 1 or random.random() < rate
+
+    @staticmethod
+    def preview(items, limit=None) -> str:
+        """
+        截断预览, 超过字节上限即停止格式化
+        """
+        limit = conf.SQL_LOG_PREVIEW_BYTES if limit is None else limit
+        parts = []
+        size = 0
+        for item in items:
+            text = repr(item)
+            size += len(text.encode())
+            if size > limit:
+                parts.append(f'{text[:max(limit - size + len(text), 0)]}...')
+                break
+            parts.append(text)
+        return f'[{", ".join(parts)}]'
+
+    @staticmethod
+    def describe_binds(binds) -> str:
+        if not binds:
+            return '{}'
+        return SQLLog.preview(binds.items())
+
+    @staticmethod
+    def count(res) -> int:
+        """
+        结果条数, 兼容列式结果
+        """
+        if isinstance(res, dict) and 'columns' in res:
+            return len(res['rows'])
+        return len(res) if isinstance(res, list) else 1
+
+    @staticmethod
+    def describe_result(res) -> str:
+        """
+        按 SQL_LOG_RESULT 描述结果: count 仅条数, preview 条数 + 截断预览, full 完整结果
+        """
+        mode = conf.SQL_LOG_RESULT
+        count = SQLLog.count(res)
+        if mode == 'full':
+            return f'{count}条记录 {res}'
+        if mode == 'preview':
+            if isinstance(res, dict) and 'columns' in res:
+                return f'{count}条记录 {res["columns"]} {SQLLog.preview(res["rows"])}'
+            return f'{count}条记录 {SQLLog.preview(res if isinstance(res, list) else [res])}'
+        return f'{count}条记录'
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import uuid
+
+from src import conf
+from src.library.error import ParamError
+from src.library.model import SQLServer
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    try:
+        # 旧版本 python-multipart 的包名
+        from multipart.multipart import MultipartParser, parse_options_header
+    except ImportError:
+        MultipartParser = parse_options_header = None
+
+
+class StreamUpload:
+    """
+    流式上传: 边解析 multipart 请求体边写入临时文件并增量计算 MD5(在线程池中执行)
+    记录提交后(store)按内容哈希存放于 UPLOAD_DIR/<md5前两位>/<md5>, 相同内容只保存一份; 回滚时(discard)删除临时文件
+    """
+    # 文件字段名
+    FIELD = 'file'
+
+    def __init__(self, headers, upload_dir=None):
+        if MultipartParser is None:
+            raise ParamError('未安装 python-multipart, 无法解析上传')
+        content_type, options = parse_options_header(headers.get('content-type', ''))
+        if content_type != b'multipart/form-data' or b'boundary' not in options:
+            raise ParamError('上传须为 multipart/form-data')
+        self.upload_dir = str(upload_dir or conf.UPLOAD_DIR)
+        self.parser = MultipartParser(options[b'boundary'], {
+            'on_part_begin': self.on_part_begin,
+            'on_header_field': self.on_header_field,
+            'on_header_value': self.on_header_value,
+            'on_header_end': self.on_header_end,
+            'on_headers_finished': self.on_headers_finished,
+            'on_part_data': self.on_part_data,
+            'on_part_end': self.on_part_end,
+        })
+        self.md5 = hashlib.md5()
+        self.digest = None
+        self.size = 0
+        self.file = None
+        self.temp_path = None
+        self.filename = None
+        self.mime = None
+        self.done = False
+        # 当前 part
+        self.headers = {}
+        self.header_name = b''
+        self.header_value = b''
+        self.writing = False
+
+    def on_part_begin(self):
+        self.headers = {}
+        self.writing = False
+
+    def on_header_field(self, data, start, end):
+        self.header_name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header_name.lower()] = self.header_value
+        self.header_name = b''
+        self.header_value = b''
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.headers.get(b'content-disposition', b''))
+        if options.get(b'name', b'').decode(errors='replace') != self.FIELD or b'filename' not in options:
+            # 其他表单字段忽略
+            return
+        if self.done or self.file is not None:
+            raise ParamError('仅支持上传单个文件')
+        self.filename = os.path.basename(options[b'filename'].decode(errors='replace')) or 'unnamed'
+        content_type = self.headers.get(b'content-type', b'').decode(errors='replace').strip()
+        if not content_type or content_type == 'application/octet-stream':
+            content_type = mimetypes.guess_type(self.filename)[0] or content_type or 'application/octet-stream'
+        self.mime = content_type
+
+        temp_dir = os.path.join(self.upload_dir, 'tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        self.temp_path = os.path.join(temp_dir, uuid.uuid4().hex)
+        # 按固定大小的缓冲块写盘
+        self.file = open(self.temp_path, 'wb', buffering=conf.UPLOAD_WRITE_BYTES)
+        self.writing = True
+
+    def on_part_data(self, data, start, end):
+        if not self.writing:
+            return
+        chunk = data[start:end]
+        self.size += len(chunk)
+        if self.size > conf.UPLOAD_MAX_BYTES:
+            raise ParamError(f'上传文件超过{conf.UPLOAD_MAX_BYTES}字节')
+        self.md5.update(chunk)
+        self.file.write(chunk)
+
+    def on_part_end(self):
+        if self.writing:
+            self.file.close()
+            self.writing = False
+            self.done = True
+
+    def feed(self, chunk: bytes):
+        """
+        [线程池]解析一块请求体
+        """
+        try:
+            self.parser.write(chunk)
+        except ParamError:
+            raise
+        except Exception as e:
+            raise ParamError(f'上传内容解析失败: {e}')
+
+    def finish(self) -> dict:
+        """
+        [线程池]结束解析, 文件仍在临时目录, 由 store 存放
+        :return: {'md5', 'size', 'filename', 'mime', 'path', 'duplicate'}
+        """
+        try:
+            self.parser.finalize()
+        except Exception as e:
+            raise ParamError(f'上传内容解析失败: {e}')
+        if not self.done:
+            raise ParamError(f'缺少上传文件 {self.FIELD}')
+        self.digest = self.md5.hexdigest()
+        path = self.storage_path(self.digest)
+        return {
+            'md5': self.digest,
+            'size': self.size,
+            'filename': self.filename,
+            'mime': self.mime,
+            'path': path,
+            'duplicate': os.path.exists(path),
+        }
+
+    def storage_path(self, digest) -> str:
+        return os.path.join(self.upload_dir, digest[:2], digest)
+
+    def store(self):
+        """
+        [线程池]记录提交后按内容哈希存放, 相同内容已存在时丢弃临时文件
+        """
+        if self.temp_path is None or self.digest is None:
+            return
+        path = self.storage_path(self.digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(self.temp_path)
+        else:
+            os.replace(self.temp_path, path)
+        self.temp_path = None
+
+    def discard(self):
+        """
+        [线程池]出错时清理临时文件
+        """
+        if self.file is not None and not self.file.closed:
+            self.file.close()
+        if self.temp_path is not None and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        self.temp_path = None
+
+    async def receive(self, stream) -> dict:
+        """
+        读取请求体, 上传文件写入临时目录
+        """
+        server = SQLServer()
+        running = None
+        try:
+            async for chunk in stream:
+                if chunk:
+                    running = server.run_async(self.feed, chunk)
+                    await running
+            running = server.run_async(self.finish)
+            return await running
+        except BaseException:
+            # 被取消(如客户端断开)时同样清理, 清理本身不随取消中断
+            await asyncio.shield(self.cleanup(server, running))
+            raise
+
+    async def cleanup(self, server: SQLServer, running):
+        """
+        等待执行中的写入结束后再删除临时文件
+        """
+        if running is not None and not running.done():
+            await asyncio.wait([running])
+        await server.run_async(self.discard)
@@ -0,0 +1,82 @@
+from src import conf
+from src.library.cache import query_cache
+from src.library.error import DBError
+from src.library.micro_batch import MicroBatcher
+from src.library.model import SQLServer
+
+
+class WriteCoalescer(MicroBatcher):
+    """
+    组提交: 同一表在时间窗口内(或达到数量上限时)到达的单行插入合并到一个事务中, 只提交一次
+    每行在各自的保存点中执行, 单行失败只回滚该行; 各调用方得到自己插入的记录或异常
+    """
+    WINDOW_SETTING = 'WRITE_COALESCE_WINDOW'
+    MAX_SIZE_SETTING = 'WRITE_COALESCE_MAX_SIZE'
+
+    def __init__(self, window=None, max_size=None):
+        super().__init__(window, max_size)
+        self.writes = 0
+        self.errors = 0
+
+    async def insert(self, table, sql: str, binds: dict = None) -> list:
+        """
+        插入单行, 返回插入的记录
+        """
+        self.writes += 1
+        return await self.submit(table, (sql, binds))
+
+    async def run(self, table, batch):
+        server = SQLServer()
+        items = [item for item, _ in batch]
+        try:
+            results = await server.connect_async(self.write, server, table, items)
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), res in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(res, Exception):
+                self.errors += 1
+                future.set_exception(res)
+            else:
+                future.set_result(res)
+
+    @staticmethod
+    def write(server: SQLServer, table, items) -> list:
+        """
+        [线程池]在一个事务中逐行插入, 每行一个保存点
+        """
+        results = []
+        session = SQLServer.get_db()
+        try:
+            for sql, binds in items:
+                savepoint = session.begin_nested()
+                try:
+                    results.append(server.write_rows(session, sql, table, 'insert', binds))
+                    savepoint.commit()
+                except Exception as e:
+                    conf.log.error(f'数据库执行异常: {e}')
+                    savepoint.rollback()
+                    results.append(DBError('数据库执行异常'))
+            session.commit()
+        except Exception as e:
+            conf.log.error(f'组提交失败: {e}')
+            session.rollback()
+            results = [DBError('数据库执行异常')] * len(items)
+        finally:
+            session.close()
+            query_cache.invalidate(table)
+        conf.log.info(f'组提交{table}: {len(items)}条插入, 一次提交')
+        return results
+
+    def stats(self) -> dict:
+        return {
+            'writes': self.writes,
+            'batches': self.batches,
+            'errors': self.errors,
+            'avg_batch': round(self.writes / self.batches, 2) if self.batches else 0,
+            'pending': self.pending_count(),
+        }
+
+
+write_coalescer = WriteCoalescer()
@@ -62,14 +62,29 @@ param example:
         'offset': 0,
         # select 可用
         'keys': ['id', 'name'],
-        # insert/update 必要
+        # select 可用, 游标(keyset)分页: (utime, id) > (1718000000, 42)
+        'seek': {
+            'keys': ['utime', 'id'],
+            'values': [1718000000, 42],
+            'order': 'asc'
+        },
+        # insert/update/upsert 必要; insert/upsert 可为字段相同的字典列表(多行插入)
         'values': {
             'age': 30,
             'score': 80,
+        },
+        # upsert 可用: 冲突判定字段(sqlite 必要)、冲突时更新的字段、方言(mysql/sqlite)
+        'upsert': {
+            'keys': ['id'],
+            'update': ['score'],
+            'dialect': 'mysql'
         }
     }
 """
 import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 
 
 class Query:
@@ -96,8 +111,12 @@ class Query:
 
         self.keys = []
 
+        self.seek = {}
+
         self.values = {}
 
+        self.upsert = {}
+
     def build(self):
         params = {}
 
@@ -129,20 +148,48 @@ class Query:
             params['offset'] = self.offset
         if self.keys:
             params['keys'] = self.keys
+        if self.seek:
+            params['seek'] = self.seek
         if self.values:
             params['values'] = self.values
+        if self.upsert:
+            params['upsert'] = self.upsert
 
         return params
 
 
 class QueryBuild:
+    """
+    参数 => 带占位符的sql + 绑定参数
+    相同结构(shape)的参数只构造一次sql, 之后直接从缓存取出, 仅重新收集绑定值
+    缓存在事件循环及线程池(如导入)中共用, 读写均加锁
+    """
+    OPERATORS = {
+        'eq': '=',
+        'neq': '<>',
+        'lt': '<',
+        'lte': '<=',
+        'gt': '>',
+        'gte': '>=',
+        'like': 'LIKE',
+        'rlike': 'RLIKE'
+    }
+    # 已编译sql的LRU缓存: shape -> sql
+    CACHE = OrderedDict()
+    CACHE_SIZE = 512
+    CACHE_LOCK = threading.Lock()
+    HITS = 0
+    MISSES = 0
+
     def __init__(self, param):
         self.param = param
         self.base = None
         self.query = []
         self.sql = None
+        self.binds = {}
 
     @staticmethod
+    @lru_cache(maxsize=1024)
     def decorate_key(keyword):
         r = re.match(r'^(?P<func>[a-zA-Z]*)\((?P<key>.*)\)', keyword)
         if not r:
@@ -162,18 +209,15 @@ class QueryBuild:
             keyword = f'{r.group("func")}(`{r.group("key")}`)'
         return keyword
 
-    @staticmethod
-    def generate_rela(keyword, condition: dict):
-        operators = {
-            'eq': '=',
-            'neq': '<>',
-            'lt': '<',
-            'lte': '<=',
-            'gt': '>',
-            'gte': '>=',
-            'like': 'LIKE',
-            'rlike': 'RLIKE'
-        }
+    def bind(self, value):
+        """
+        登记绑定参数, 返回占位符
+        """
+        name = f'p{len(self.binds)}'
+        self.binds[name] = value
+        return f':{name}'
+
+    def generate_rela(self, keyword, condition: dict):
         # compare, val = condition.popitem()
         compare, val = condition.copy().popitem()
 
@@ -185,8 +229,8 @@ class QueryBuild:
 
         compare = compare.lower()
 
-        if compare in operators:
-            return f'{keyword} {operators[compare]} {val}'
+        if compare in self.OPERATORS:
+            return f'{keyword} {self.OPERATORS[compare]} {self.bind(val)}'
         elif compare == 'ex':
             if val:
                 # val == True
@@ -196,25 +240,32 @@ class QueryBuild:
         elif compare == 'between':
             if not isinstance(val, list) or len(val) != 2:
                 raise Exception('Invalid relation')
-            return f'{keyword} BETWEEN {val[0]} AND {val[1]}'
+            return f'{keyword} BETWEEN {self.bind(val[0])} AND {self.bind(val[1])}'
         elif compare == 'in':
-            if not isinstance(val, list):
+            if not isinstance(val, list) or not val:
                 raise Exception('Invalid relation')
-            return f'{keyword} IN ({",".join(val)})'
+            return f'{keyword} IN ({", ".join(self.bind(v) for v in val)})'
         else:
             raise Exception(f'Unsupported comparison operator: {compare}')
 
-    def build_condition(self, conditions):
+    def build_equal(self, keyword, value, columns=False):
+        """
+        等值条件, columns为True时右值为字段名(join on)
+        """
+        if value is None:
+            return f'{self.decorate_key(keyword)} is null'
+        if columns:
+            return f'{self.decorate_key(keyword)} = {self.decorate_key(value)}'
+        return f'{self.decorate_key(keyword)} = {self.bind(value)}'
+
+    def build_condition(self, conditions, columns=False):
         if not isinstance(conditions, dict):
             raise TypeError('conditions must be a dict')
         query = []
         for key, value in conditions.items():
 
             if not isinstance(value, dict):
-                if value is None:
-                    query.append(f'{self.decorate_key(key)} is null')
-                else:
-                    query.append(f'{self.decorate_key(key)} = "{value}"')
+                query.append(self.build_equal(key, value, columns))
             elif key not in ['and', 'or'] and isinstance(value, dict):
                 query.append(self.generate_rela(self.decorate_key(key), value))
             elif key in ['and', 'or'] and isinstance(value, dict):
@@ -224,10 +275,7 @@ class QueryBuild:
                     deep += 1
 
                     if not isinstance(inner_value, dict):
-                        if inner_value is None:
-                            query.append(f'{self.decorate_key(inner_key)} is null')
-                        else:
-                            inner_query.append(f'{self.decorate_key(inner_key)} = "{inner_value}"')
+                        inner_query.append(self.build_equal(inner_key, inner_value, columns))
 
                     elif isinstance(inner_value, dict):
                         inner_query.append(self.generate_rela(self.decorate_key(inner_key), inner_value))
@@ -265,6 +313,8 @@ class QueryBuild:
             self.build_select()
         elif way == 'insert':
             self.build_insert()
+        elif way == 'upsert':
+            self.build_upsert()
         elif way == 'update':
             self.build_update()
         elif way == 'delete':
@@ -294,14 +344,41 @@ class QueryBuild:
         values = self.param.get('values', None)
         if not values:
             raise Exception('Values must be specified')
-        if not isinstance(values, dict):
-            raise Exception('Values must be dict')
-        keys = [f'{self.decorate_key(k)}' for k in values.keys()]
-        # vals = [f'"{v}"' for v in values.values()]
+        rows = values if isinstance(values, list) else [values]
+        if not all(isinstance(row, dict) for row in rows):
+            raise Exception('Values must be dict or list of dict')
+        columns = list(rows[0].keys())
+        if any(row.keys() != rows[0].keys() for row in rows):
+            raise Exception('All rows must have the same keys')
+        keys = [f'{self.decorate_key(k)}' for k in columns]
         self.query.append(f'{self.decorate_key(self.base.get("table", None))}({", ".join(keys)})')
         self.query.append('VALUES')
-        decorate_vals = ['null' if v is None else f'"{v}"' for v in values.values()]
-        self.query.append(f'({", ".join(decorate_vals)})')
+        self.query.append(', '.join(f'({", ".join(self.bind(row[k]) for k in columns)})' for row in rows))
+
+    def build_upsert(self):
+        """
+        插入, 冲突时更新: mysql ON DUPLICATE KEY UPDATE; sqlite/postgresql ON CONFLICT DO UPDATE
+        """
+        self.build_insert()
+        upsert = self.param.get('upsert', None) or {}
+        keys = upsert.get('keys', None) or []
+        updates = upsert.get('update', None) or []
+        dialect = upsert.get('dialect', None) or 'mysql'
+        if dialect in ('mysql', 'mariadb'):
+            sets = [f'{self.decorate_key(k)} = VALUES({self.decorate_key(k)})' for k in updates]
+            if not sets:
+                # 无可更新字段时保持原记录
+                sets = [f'{self.decorate_key(keys[0] if keys else "id")} = {self.decorate_key(keys[0] if keys else "id")}']
+            self.query.append(f'ON DUPLICATE KEY UPDATE {", ".join(sets)}')
+            return
+        if not keys:
+            raise Exception('Upsert keys must be specified')
+        self.query.append(f'ON CONFLICT ({", ".join(self.decorate_key(k) for k in keys)})')
+        if updates:
+            sets = [f'{self.decorate_key(k)} = excluded.{self.decorate_key(k)}' for k in updates]
+            self.query.append(f'DO UPDATE SET {", ".join(sets)}')
+        else:
+            self.query.append('DO NOTHING')
 
     def build_update(self):
         self.query.append('UPDATE')
@@ -312,7 +389,7 @@ class QueryBuild:
             raise Exception('Values must be specified')
         if not isinstance(values, dict):
             raise Exception('Values must be dict')
-        sets = [f'{self.decorate_key(key)} = "{val}"' for key, val in values.items()]
+        sets = [f'{self.decorate_key(key)} = {self.bind(val)}' for key, val in values.items()]
         self.query.append(', '.join(sets))
         self.build_where()
 
@@ -357,6 +434,8 @@ class QueryBuild:
 
             alias = values.get('alias', None)
             if alias:
+                if not isinstance(alias, str) or re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', alias) is None:
+                    raise Exception(f'Invalid alias: {alias}')
                 joins_query.append(f'AS `{alias}`')
 
             on_condition = values.get('on', None)
@@ -364,15 +443,38 @@ class QueryBuild:
                 raise Exception(f'Missing conditions for on')
             else:
                 joins_query.append(f'ON')
-                joins_query.append(self.build_condition(on_condition))
+                joins_query.append(self.build_condition(on_condition, columns=True))
         self.query.append(' '.join(joins_query))
 
     def build_where(self):
         where = self.param.get('where', None)
-        if not where:
+        seek = self.param.get('seek', None)
+        if not where and not seek:
             return
         self.query.append('WHERE')
-        self.query.append(self.build_condition(self.param['where']))
+        conditions = []
+        if where:
+            conditions.append(self.build_condition(where))
+        if seek:
+            conditions.append(self.build_seek(seek))
+        self.query.append(' AND '.join(conditions))
+
+    def build_seek(self, seek):
+        """
+        游标分页条件: (k1, k2) > (v1, v2), 降序时为 <
+        """
+        if not isinstance(seek, dict):
+            raise Exception(f'Invalid seek: {seek}')
+        keys = seek.get('keys', None)
+        values = seek.get('values', None)
+        if not isinstance(keys, list) or not isinstance(values, list) or not keys or len(keys) != len(values):
+            raise Exception(f'Invalid seek: {seek}')
+        compare = '<' if str(seek.get('order', 'asc')).lower() == 'desc' else '>'
+        columns = ', '.join(self.decorate_key(k) for k in keys)
+        binds = ', '.join(self.bind(v) for v in values)
+        if len(keys) == 1:
+            return f'{columns} {compare} {binds}'
+        return f'({columns}) {compare} ({binds})'
 
     def build_group(self):
         groups = self.param.get('group', None)
@@ -405,6 +507,8 @@ class QueryBuild:
         order_query = []
         for order in orders:
             if isinstance(order, (tuple, list)):
+                if len(order) != 2 or str(order[1]).lower() not in ('asc', 'desc'):
+                    raise Exception(f'Unsupported order: {order}')
                 order_query.append(f'{self.decorate_key(order[0])} {order[1].upper()}')
             elif isinstance(order, str):
                 order_query.append(f'{self.decorate_key(order)}')
@@ -414,17 +518,170 @@ class QueryBuild:
         limits = self.param.get('limit', None)
         if not limits:
             return
-        self.query.append(f'LIMIT {int(limits)}')
+        self.query.append(f'LIMIT {self.bind(int(limits))}')
 
     def build_offset(self):
         offsets = self.param.get('offset', None)
         if not offsets:
             return
-        self.query.append(f'OFFSET {int(offsets)}')
+        self.query.append(f'OFFSET {self.bind(int(offsets))}')
+
+    @staticmethod
+    def freeze(item):
+        """
+        将参数中的结构部分转为可哈希的元组
+        """
+        if isinstance(item, dict):
+            return 'dict', tuple((k, QueryBuild.freeze(v)) for k, v in item.items())
+        if isinstance(item, (list, tuple)):
+            return type(item).__name__, tuple(QueryBuild.freeze(v) for v in item)
+        return item
+
+    @staticmethod
+    def shape_equal(key, value, values, columns=False):
+        if value is None:
+            return key, 'null'
+        if columns:
+            return key, 'column', value
+        values.append(value)
+        return key, 'eq'
+
+    @staticmethod
+    def shape_rela(key, condition, values):
+        if not condition:
+            return key, 'rela'
+        compare, val = condition.copy().popitem()
+        shape = (key, str(compare).lower(), type(val).__name__)
+        if shape[1] == 'ex':
+            return shape + (bool(val),)
+        if shape[1] in ('between', 'in') and isinstance(val, list):
+            values.extend(val)
+            return shape + (len(val),)
+        values.append(val)
+        return shape
+
+    @staticmethod
+    def shape_condition(conditions, values, columns=False):
+        """
+        条件的结构: 字段、比较方式、值类型; 值按构造sql时的绑定顺序收集
+        """
+        if not isinstance(conditions, dict):
+            return type(conditions).__name__
+        shape = []
+        for key, value in conditions.items():
+            if not isinstance(value, dict):
+                shape.append(QueryBuild.shape_equal(key, value, values, columns))
+            elif key not in ['and', 'or']:
+                shape.append(QueryBuild.shape_rela(key, value, values))
+            else:
+                inner = []
+                for inner_key, inner_value in value.items():
+                    if not isinstance(inner_value, dict):
+                        inner.append(QueryBuild.shape_equal(inner_key, inner_value, values, columns))
+                    else:
+                        inner.append(QueryBuild.shape_rela(inner_key, inner_value, values))
+                shape.append((key, tuple(inner)))
+        return tuple(shape)
+
+    @staticmethod
+    def shape_where(param, values):
+        """
+        where 及游标分页条件的结构
+        """
+        shape = QueryBuild.shape_condition(param.get('where', None) or {}, values)
+        seek = param.get('seek', None)
+        if not seek:
+            return shape, None
+        if not isinstance(seek, dict) or not isinstance(seek.get('values', None), list):
+            return shape, QueryBuild.freeze(seek)
+        values.extend(seek['values'])
+        return shape, (QueryBuild.freeze(seek.get('keys', None)), len(seek['values']),
+                       str(seek.get('order', 'asc')).lower() == 'desc')
+
+    def shape(self):
+        """
+        参数结构及按绑定顺序排列的值
+        :return: (shape, values)
+        """
+        param = self.param
+        values = []
+        base = param.get('base', None)
+        shape = [self.freeze(base)]
+        way = base.get('way', None) if isinstance(base, dict) else None
+
+        if way == 'select':
+            shape.append(self.freeze(param.get('keys', None)))
+            joins = param.get('joins', None)
+            if joins and isinstance(joins, list):
+                shape.append(tuple(
+                    (self.freeze({k: v for k, v in join.items() if k != 'on'}),
+                     self.shape_condition(join.get('on', None), values, columns=True))
+                    if isinstance(join, dict) else self.freeze(join) for join in joins))
+            else:
+                shape.append(self.freeze(joins))
+            shape.append(self.shape_where(param, values))
+            shape.append(self.freeze(param.get('group', None)))
+            shape.append(self.shape_condition(param.get('having', None) or {}, values))
+            shape.append(self.freeze(param.get('order', None)))
+            for name in ('limit', 'offset'):
+                item = param.get(name, None)
+                shape.append(bool(item))
+                if item:
+                    values.append(int(item))
+        elif way in ('insert', 'upsert', 'update'):
+            items = param.get('values', None)
+            if way == 'upsert':
+                shape.append(self.freeze(param.get('upsert', None)))
+            if isinstance(items, dict):
+                shape.append(tuple(items.keys()))
+                values.extend(items.values())
+            elif way != 'update' and isinstance(items, list) and items and all(isinstance(row, dict) for row in items):
+                columns = tuple(items[0].keys())
+                # 多行插入: 字段及行数相同的参数共用一条sql
+                shape.append((columns, len(items)))
+                for row in items:
+                    values.extend(row.get(k) for k in columns)
+            else:
+                shape.append(self.freeze(items))
+            if way == 'update':
+                shape.append(self.shape_where(param, values))
+        else:
+            shape.append(self.shape_where(param, values))
+        return tuple(shape), values
+
+    @classmethod
+    def cache_stats(cls):
+        with cls.CACHE_LOCK:
+            return {'size': len(cls.CACHE), 'hits': cls.HITS, 'misses': cls.MISSES}
 
     def build(self):
+        try:
+            shape, values = self.shape()
+            hash(shape)
+        except (TypeError, ValueError, AttributeError):
+            shape, values = None, None
+
+        cache = QueryBuild.CACHE
+        with QueryBuild.CACHE_LOCK:
+            sql = cache.get(shape) if shape is not None else None
+            if sql is not None:
+                cache.move_to_end(shape)
+                QueryBuild.HITS += 1
+            else:
+                QueryBuild.MISSES += 1
+        if sql is not None:
+            self.sql = sql
+            self.binds = {f'p{i}': v for i, v in enumerate(values)}
+            return self
+
         self.build_init()
         self.sql = f' '.join(self.query) + ';'
+        # 绑定值与结构收集的值一致时才缓存
+        if shape is not None and list(self.binds.values()) == values:
+            with QueryBuild.CACHE_LOCK:
+                cache[shape] = self.sql
+                if len(cache) > QueryBuild.CACHE_SIZE:
+                    cache.popitem(last=False)
         return self
 
 
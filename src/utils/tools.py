@@ -5,23 +5,45 @@ import sys
 import re
 import hashlib
 import json
-import inspect
+import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class DataHandler:
+    # 不允许由请求传入的参数
+    FORBIDDEN = ['base']
+    # JSON数字
+    NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?')
+    # JSON字面量
+    LITERALS = {'true': True, 'false': False, 'null': None}
+
     @staticmethod
-    def filter_data(items: dict, forbidden: list):
-        temp = {}
-        for item in items:
-            value = items.get(item)
-            if item in forbidden:
-                continue
+    def decode_value(value):
+        """
+        参数值转python对象: 先按首字符判断, 只有形如JSON对象/数组/字符串的值才尝试解析
+        """
+        if not isinstance(value, str) or not value:
+            return value
+        head = value[0]
+        if head in '{["':
             try:
-                value = json.loads(value)
-            except Exception:
-                pass
-            finally:
-                temp.update({item: value})
-        return temp
+                return json.loads(value)
+            except ValueError:
+                return value
+        if head == '-' or head.isdigit():
+            match = DataHandler.NUMBER.fullmatch(value)
+            if match is None:
+                return value
+            return float(value) if match.group(1) or match.group(2) else int(value)
+        return DataHandler.LITERALS.get(value, value)
+
+    @staticmethod
+    def filter_data(items: dict, forbidden: list):
+        return {item: DataHandler.decode_value(value) for item, value in items.items() if item not in forbidden}
 
     @staticmethod
     def check_keys(items: dict, keys: list):
@@ -132,13 +154,90 @@ class TimeTool:
         return time.strftime(format_type, time.localtime(timestamp))
 
 
+class JsonTool:
+    """
+    JSON编码: 直接输出 bytes, 不排序键; 默认优先 orjson, 未安装时回退标准库
+    可通过 register 注册其他编码器, 配置项 JSON_ENCODER 选择
+    """
+    ENCODERS = {}
+    # 当前使用的编码器, 首次编码时按配置选择
+    encoder = None
+
+    @staticmethod
+    def default(obj):
+        """
+        编码器不支持的类型(Decimal、bytes、日期等)
+        """
+        if isinstance(obj, (datetime.date, datetime.time)):
+            return obj.isoformat()
+        if isinstance(obj, (bytes, bytearray)):
+            return obj.decode(errors='replace')
+        return str(obj)
+
+    @classmethod
+    def register(cls, name, func):
+        """
+        注册编码器: func(obj) -> bytes
+        """
+        cls.ENCODERS[name] = func
+
+    @classmethod
+    def use(cls, name='auto'):
+        """
+        选择编码器, auto 优先 orjson
+        """
+        if name == 'auto':
+            name = 'orjson' if 'orjson' in cls.ENCODERS else 'json'
+        if name not in cls.ENCODERS:
+            raise ValueError(f'未注册的JSON编码器: {name}')
+        cls.encoder = cls.ENCODERS[name]
+        return cls.encoder
+
+    @staticmethod
+    def loads(content):
+        """
+        JSON解码, 接受 str/bytes
+        """
+        return orjson.loads(content) if orjson is not None else json.loads(content)
+
+    @classmethod
+    def dumps(cls, obj) -> bytes:
+        if cls.encoder is None:
+            from src import conf
+            cls.use(getattr(conf, 'JSON_ENCODER', 'auto'))
+        return cls.encoder(obj)
+
+
+JsonTool.register('json', lambda obj: json.dumps(
+    obj, ensure_ascii=False, separators=(',', ':'), default=JsonTool.default).encode())
+if orjson is not None:
+    JsonTool.register('orjson', lambda obj: orjson.dumps(
+        obj, default=JsonTool.default, option=orjson.OPT_NON_STR_KEYS))
+
+
 class LogTool:
-    def __init__(self, log_level="DEBUG", log_file="temp.log", project_root='', is_debug=False):
+    # 各级别的数值, 与 loguru 一致
+    LEVELS = {
+        "DEBUG": 10,
+        "INFO": 20,
+        "SUCCESS": 25,
+        "WARNING": 30,
+        "ERROR": 40,
+        "EXCEPTION": 40,
+        "CRITICAL": 50,
+    }
+
+    def __init__(self, log_level="DEBUG", log_file="temp.log", project_root='', is_debug=False, capture=False):
         self.log_level = log_level
         self.log_file = log_file
         self.is_debug = is_debug
+        # 是否记录最后一条日志作为返回值, 关闭时不注册捕获输出
+        self.capture = capture
+        self.level_no = self.LEVELS.get(log_level.upper(), 0)
         # 项目根目录
         self.project_root = project_root
+        # 文件路径 -> 相对项目根目录的模块路径
+        self.paths = {}
         self.logger = logger
         self.configure_logging()
         self.last_info = None
@@ -165,38 +264,55 @@ class LogTool:
         )
         if self.is_debug:
             self.logger.add(sys.stdout, level=self.log_level, backtrace=True, format=color_format)
-        self.logger.add(self.capture_msg, format=color_format)
+        if self.capture:
+            self.logger.add(self.capture_msg, format=color_format)
 
-    def prefix_info(self):
-        frame = inspect.stack()[3]
-        file_path = os.path.splitext(os.path.relpath(frame.filename, self.project_root))[0]
-        prefix = f"{file_path}{'.' + frame.function if frame.function != '<module>' else ''}:{frame.lineno} "
+    def is_enabled(self, level: str) -> bool:
+        """
+        该级别日志是否会输出, 供调用方跳过昂贵的消息构造
+        """
+        return self.LEVELS.get(level.upper(), 0) >= self.level_no
+
+    def prefix_info(self, depth=3):
+        # 只取调用方所在的一帧, 不构造整个调用栈
+        frame = sys._getframe(depth)
+        code = frame.f_code
+        file_path = self.paths.get(code.co_filename)
+        if file_path is None:
+            file_path = os.path.splitext(os.path.relpath(code.co_filename, self.project_root))[0]
+            self.paths[code.co_filename] = file_path
+        function = code.co_name
+        prefix = f"{file_path}{'.' + function if function != '<module>' else ''}:{frame.f_lineno} "
         return prefix
 
-    def msg_struct(self, level: str, msg: str):
+    def msg_struct(self, level: str, msg: str, *args):
+        if self.LEVELS.get(level, 0) < self.level_no:
+            return None
         prefix = self.prefix_info()
+        if args:
+            msg = msg % args
         msg = msg.replace('{', '【').replace('}', '】')
         log_method = getattr(self.logger, level.lower())
         log_method(msg, prefix=prefix)
         return self.last_info
 
-    def info(self, msg):
-        return self.msg_struct(level="INFO", msg=msg)
+    def info(self, msg, *args):
+        return self.msg_struct("INFO", msg, *args)
 
-    def debug(self, msg):
-        return self.msg_struct(level="DEBUG", msg=msg)
+    def debug(self, msg, *args):
+        return self.msg_struct("DEBUG", msg, *args)
 
-    def warning(self, msg):
-        return self.msg_struct(level="WARNING", msg=msg)
+    def warning(self, msg, *args):
+        return self.msg_struct("WARNING", msg, *args)
 
-    def error(self, msg):
-        return self.msg_struct(level="ERROR", msg=msg)
+    def error(self, msg, *args):
+        return self.msg_struct("ERROR", msg, *args)
 
-    def success(self, msg):
-        return self.msg_struct(level="SUCCESS", msg=msg)
+    def success(self, msg, *args):
+        return self.msg_struct("SUCCESS", msg, *args)
 
-    def critical(self, msg):
-        return self.msg_struct(level="CRITICAL", msg=msg)
+    def critical(self, msg, *args):
+        return self.msg_struct("CRITICAL", msg, *args)
 
-    def exception(self, msg):
-        return self.msg_struct(level="EXCEPTION", msg=msg)
+    def exception(self, msg, *args):
+        return self.msg_struct("EXCEPTION", msg, *args)
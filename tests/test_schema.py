@@ -0,0 +1,72 @@
+import pytest
+
+from api.model.files import Files
+from api.model.users import Users
+from src.library.error import ParamError
+from src.library.schema import registry
+from src.utils.make_sql import QueryBuild
+
+
+def select(**params):
+    return {'base': {'table': 'files', 'way': 'select'}, **params}
+
+
+@pytest.mark.parametrize('direction', [
+    'asc, (select password from users where id=1)',
+    'asc limit 1) --',
+    'ascending',
+    1,
+])
+def test_order_direction_rejected(direction):
+    with pytest.raises(ParamError):
+        registry.get(Files).validate('select', select(order=[['id', direction]]))
+    with pytest.raises(Exception):
+        QueryBuild(select(order=[['id', direction]])).build()
+
+
+def test_order_direction_normalized():
+    params = registry.get(Files).validate('select', select(order=[['id', 'DESC'], 'oname']))
+    assert params['order'] == [('id', 'desc'), 'oname']
+    assert QueryBuild(params).build().sql.endswith('ORDER BY `id` DESC, `oname`;')
+
+
+def test_order_on_excluded_column_rejected():
+    params = {'base': {'table': 'users', 'way': 'select'}, 'order': [['password', 'asc']]}
+    with pytest.raises(ParamError):
+        registry.get(Users).validate('select', params)
+
+
+@pytest.mark.parametrize('alias', [
+    "x` ON (select substr(password,1,1) from users where id=1)='s' LEFT JOIN `files",
+    'f 2',
+    '2f',
+    ['f'],
+])
+def test_join_alias_rejected(alias):
+    joins = [{'table': 'files', 'alias': alias, 'on': {'files.id': 'files.id'}}]
+    with pytest.raises(ParamError):
+        registry.get(Files).validate('select', select(joins=joins))
+    with pytest.raises(Exception):
+        QueryBuild(select(joins=joins)).build()
+
+
+def test_join_unregistered_table_rejected():
+    joins = [{'table': 'sqlite_master', 'alias': 'm', 'on': {'m.rootpage': 'files.id'}}]
+    with pytest.raises(ParamError):
+        registry.get(Files).validate('select', select(joins=joins))
+
+
+def test_projection_qualified_with_joins():
+    params = {'joins': [{'table': 'files', 'alias': 'f2', 'on': {'files.id': 'f2.id'}}]}
+    schema = registry.get(Files)
+    assert schema.projection(None, params)[0] == 'files.id'
+    assert schema.projection('id,f2.oname', params) == ['files.id', 'f2.oname']
+    assert schema.projection('files.id') == ['files.id']
+    with pytest.raises(ParamError):
+        schema.projection('zz.id', params)
+
+
+def test_projection_excluded_column_rejected():
+    params = {'joins': [{'table': 'users', 'alias': 'u', 'on': {'u.id': 'files.id'}}]}
+    with pytest.raises(ParamError):
+        registry.get(Files).projection('u.password', params)